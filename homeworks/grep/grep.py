@@ -1,7 +1,15 @@
 import argparse
+import mmap
+import os
 import re
 import sys
 from collections import deque, namedtuple
+from multiprocessing import Pool
+
+# Bytes of a file searched by one worker process.
+CHUNK_SIZE = 16 * 1024 * 1024
+# Most bytes read from a stream at once.
+READ_SIZE = 64 * 1024
 
 
 def output(line):
@@ -10,6 +18,7 @@ def output(line):
 
 class Grep:
     def __init__(self, params):
+        self.params = params
         self.line_number = params.line_number
         self.invert = params.invert
 
@@ -56,20 +65,25 @@ class Grep:
             else:
                 output(line)
 
-    def grep(self, lines) -> None:
-        for line_number, line in enumerate(lines, start=1):
+    def search(self, lines, first_line_number=1):
+        """Yields (line_number, line, context_line) of the lines to output.
+
+        The context state is kept between calls, so lines can be searched
+        in several parts.
+        """
+        for line_number, line in enumerate(lines, start=first_line_number):
             line = line.rstrip()
 
             matched = self.match(line)
             if matched is True:
                 if self.before_context:
                     for line_before in self.before_context_deque:
-                        self._output(line_before.line_number, line_before.line, True)
+                        yield line_before.line_number, line_before.line, True
                     self.before_context_deque.clear()
                 if self.after_context:
                     self.after_context_counter = self.after_context_len
 
-                self._output(line_number, line, False)
+                yield line_number, line, False
             else:
                 if self.before_context:
                     if self.after_context_counter == 0:
@@ -81,11 +95,143 @@ class Grep:
                     if self.after_context_counter == 0:
                         pass
                     else:
-                        self._output(line_number, line, True)
+                        yield line_number, line, True
                         self.after_context_counter -= 1
+
+    def grep(self, lines) -> None:
+        """Searches lines, or a binary stream that is read line by line."""
+        if hasattr(lines, "read1"):
+            lines = iter_lines(lines)
+        for line_number, line, context_line in self.search(lines):
+            self._output(line_number, line, context_line)
         if self.count is not None:
             output(str(self.count))
 
+    def grep_file(self, path, jobs=None, chunk_size=CHUNK_SIZE) -> None:
+        """Searches a file in parallel, chunk by chunk, in `jobs` processes.
+
+        Chunks end at line ends. The output is the same as of `grep`: the
+        lines of every chunk are numbered on from the ones before it, and
+        a worker starts searching enough lines before its chunk to know
+        the context state the chunk starts with.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            starts = [0]
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    while starts[-1] + chunk_size < size:
+                        end = data.find(b"\n", starts[-1] + chunk_size - 1)
+                        if end == -1 or end + 1 == size:
+                            break
+                        starts.append(end + 1)
+        chunks = [
+            (path, self.params, start, stop)
+            for start, stop in zip(starts, starts[1:] + [size])
+        ]
+
+        if len(chunks) == 1:
+            self._output_chunks(map(search_chunk, chunks))
+        else:
+            jobs = jobs or os.cpu_count() or 1
+            with Pool(jobs) as pool:
+                self._output_chunks(imap_window(pool, search_chunk, chunks, 2 * jobs))
+        if self.count is not None:
+            output(str(self.count))
+
+    def _output_chunks(self, results) -> None:
+        lines_before = 0
+        for line_count, found in results:
+            if self.count is not None:
+                self.count += found
+            else:
+                for line_number, line, context_line in found:
+                    self._output(lines_before + line_number, line, context_line)
+            lines_before += line_count
+
+
+def imap_window(pool, func, items, window):
+    """Yields func(item) for `items` in order, computed by `pool`.
+
+    Unlike `Pool.imap` at most `window` items are submitted and not taken
+    yet, so results of a slow reader do not pile up in memory.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def iter_lines(stream, size=READ_SIZE, wait=None):
+    """Yields the lines of a binary stream as they come in.
+
+    `read1` returns whatever is available, so lines are yielded without
+    waiting for a full buffer, and only a line not ended yet is held.
+    `wait` is called before every read, which may block.
+    """
+    parts = []
+    while True:
+        if wait is not None:
+            wait()
+        data = stream.read1(size)
+        if not data:
+            break
+        lines = data.split(b"\n")
+        if len(lines) == 1:
+            parts.append(data)
+            continue
+        parts.append(lines[0])
+        lines[0] = b"".join(parts)
+        parts = [lines.pop()]
+        for line in lines:
+            yield line.decode(errors="replace")
+    line = b"".join(parts)
+    if line:
+        yield line.decode(errors="replace")
+
+
+def read_lines(data, start, stop):
+    lines = data[start:stop].decode(errors="replace").split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def search_chunk(chunk):
+    """Searches a chunk of a file, returns its number of lines and findings.
+
+    Findings are the number of lines to output with -c, the lines
+    otherwise, numbered from the first line of the chunk.
+    """
+    path, params, start, stop = chunk
+    if start == stop:
+        return 0, 0 if params.count else []
+    grep = Grep(params)
+    # The context state at a line only depends on this many lines before it.
+    warm_up = grep.after_context_len + (
+        grep.before_context_deque.maxlen if grep.before_context else 0
+    )
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            first = start
+            for _ in range(warm_up):
+                if first == 0:
+                    break
+                first = data.rfind(b"\n", 0, first - 1) + 1
+            before = read_lines(data, first, start)
+            lines = read_lines(data, start, stop)
+    # Lines before the chunk are only searched to set the state, but those
+    # left as before context are output with the chunk.
+    for _ in grep.search(before, 1 - len(before)):
+        pass
+    found = grep.search(lines)
+    if params.count:
+        return len(lines), sum(1 for _ in found)
+    return len(lines), list(found)
+
 
 def parse_args(args):
     parser = argparse.ArgumentParser(description="This is a simple grep on python")
@@ -141,16 +287,36 @@ def parse_args(args):
         default=0,
         help="Print num lines of leading context before each match.",
     )
+    parser.add_argument(
+        "-j",
+        action="store",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Number of processes searching a file, all CPUs by default.",
+    )
     parser.add_argument(
         "pattern", action="store", help="Search pattern. Can contain magic symbols: ?*"
     )
+    parser.add_argument(
+        "file",
+        action="store",
+        nargs="?",
+        default=None,
+        help="File to search in parallel instead of the standard input.",
+    )
     return parser.parse_args(args)
 
 
 def main():
     params = parse_args(sys.argv[1:])
     grep = Grep(params)
-    grep.grep(sys.stdin.readlines())
+    if params.file is not None:
+        grep.grep_file(params.file, params.jobs)
+    else:
+        # Output is flushed whenever the input may block, so lines show up
+        # as soon as they are found, as in `tail -f log | grep error`.
+        grep.grep(iter_lines(sys.stdin.buffer, wait=sys.stdout.flush))
 
 
 def grep(lines, params):
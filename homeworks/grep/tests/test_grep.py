@@ -1,3 +1,7 @@
+import io
+import os
+import random
+import tempfile
 from unittest import TestCase
 
 import grep
@@ -142,3 +146,84 @@ class GrepLineNumbersTest(TestCase):
         params = grep.parse_args(["-n", "-C1", "???"])
         grep.grep(self.lines, params)
         self.assertEqual(lst, ["1-vr", "2:baab", "3:abbb", "4-fc", "5:bbb", "6-cc"])
+
+
+class GrepFileTest(TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.lines = [
+            "".join(random.choice("abc") for _ in range(random.randint(0, 6)))
+            for _ in range(400)
+        ]
+        fd, self.path = tempfile.mkstemp()
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(self.lines))
+
+    def tearDown(self):
+        lst.clear()
+
+    def test_same_as_sequential(self):
+        for args in (
+            ["-n", "aa"],
+            ["-n", "-C2", "abc"],
+            ["-n", "-B3", "-A1", "c?c"],
+            ["-n", "-A4", "-v", "a"],
+            ["-c", "-C1", "bb*a"],
+            ["-B2", "bbb"],
+        ):
+            params = grep.parse_args(args)
+            grep.grep(self.lines, params)
+            expected = lst[:]
+            lst.clear()
+            for chunk_size in (1, 7, 100, 10000):
+                grep.Grep(params).grep_file(self.path, jobs=2, chunk_size=chunk_size)
+                self.assertEqual(expected, lst, (args, chunk_size))
+                lst.clear()
+
+    def test_empty(self):
+        with open(self.path, "w"):
+            pass
+        grep.Grep(grep.parse_args(["-c", "a"])).grep_file(self.path)
+        self.assertEqual(["0"], lst)
+
+    def test_imap_window(self):
+        submitted = []
+
+        class Result:
+            def __init__(self, value):
+                self.value = value
+
+            def get(self):
+                return self.value
+
+        class ImmediatePool:
+            def apply_async(self, func, args):
+                submitted.append(args[0])
+                return Result(func(*args))
+
+        results = grep.imap_window(ImmediatePool(), str, range(10), 3)
+        self.assertEqual(["0", "1"], [next(results), next(results)])
+        self.assertEqual([0, 1, 2, 3], submitted)
+        self.assertEqual([str(i) for i in range(2, 10)], list(results))
+
+
+class GrepStreamTest(TestCase):
+    def tearDown(self):
+        lst.clear()
+
+    def test_stream(self):
+        stream = io.BytesIO("ab\r\nжж\n\nbb\nxa".encode())
+        grep.grep(stream, grep.parse_args(["-n", "-B1", "a"]))
+        self.assertEqual(["1:ab", "4-bb", "5:xa"], lst)
+
+    def test_iter_lines(self):
+        data = b"a\nbcd\n\nefghij\nk"
+        waits = []
+        lines = grep.iter_lines(
+            io.BytesIO(data), size=3, wait=lambda: waits.append(len(waits))
+        )
+        self.assertEqual(["a", "bcd", "", "efghij", "k"], list(lines))
+        self.assertEqual(6, len(waits))
+        self.assertEqual([], list(grep.iter_lines(io.BytesIO(b""))))
+        self.assertEqual(["x"], list(grep.iter_lines(io.BytesIO(b"x\n"))))
@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import time
+
+from bench_server import running_server
+from metrics import Histogram
+
+QUEUE = b"bench"
+PRELOAD_BATCH = 1000
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+
+def parse_mix(mix):
+    """Parses ["ADD=2", "GET=1", ...] into a dict of command weights."""
+    weights = dict()
+    for item in mix:
+        command, _, weight = item.partition("=")
+        if command not in ("ADD", "GET", "ACK"):
+            raise argparse.ArgumentTypeError(f"Unknown command {command}")
+        weights[command] = float(weight or 1)
+    return weights
+
+
+async def preload(ip, port, size, payload):
+    reader, writer = await asyncio.open_connection(ip, port)
+    task = b"%d %s" % (len(payload), payload)
+    for start in range(0, size, PRELOAD_BATCH):
+        count = min(PRELOAD_BATCH, size - start)
+        writer.write(b"MADD %s %d %s\n" % (QUEUE, count, b" ".join([task] * count)))
+        await reader.readline()
+    writer.close()
+
+
+async def drive_connection(ip, port, weights, payload, until, histograms):
+    reader, writer = await asyncio.open_connection(ip, port)
+    commands, weights = list(weights), list(weights.values())
+    add = b"ADD %s %d %s\n" % (QUEUE, len(payload), payload)
+    leased = []
+    empty = 0
+    while time.monotonic() < until:
+        command = random.choices(commands, weights)[0]
+        if command == "ACK" and not leased:
+            # Nothing to acknowledge yet, take a task first.
+            command = "GET"
+        match command:
+            case "ADD":
+                request = add
+            case "GET":
+                request = b"GET %s\n" % QUEUE
+            case "ACK":
+                request = b"ACK %s %s\n" % (QUEUE, leased.pop())
+        started = time.perf_counter_ns()
+        writer.write(request)
+        response = await reader.readline()
+        if command == "GET" and response != b"NONE\n":
+            task_id, length, data = response.split(b" ", 2)
+            # The payload may contain newlines, read up to its declared length.
+            await reader.readexactly(int(length) + 1 - len(data))
+            leased.append(task_id)
+        elif command == "GET":
+            empty += 1
+        histograms[command].record(time.perf_counter_ns() - started)
+    writer.close()
+    return empty
+
+
+async def drive(ip, port, connections, weights, payload, duration):
+    until = time.monotonic() + duration
+    histograms = {command: Histogram() for command in ("ADD", "GET", "ACK")}
+    empty = await asyncio.gather(
+        *(
+            drive_connection(ip, port, weights, payload, until, histograms)
+            for _ in range(connections)
+        )
+    )
+    return histograms, sum(empty)
+
+
+def run_client(ip, port, connections, weights, payload, duration):
+    return asyncio.run(drive(ip, port, connections, weights, payload, duration))
+
+
+def merge(histograms, other):
+    for command, histogram in other.items():
+        merged = histograms[command]
+        merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+        merged.count += histogram.count
+        merged.total += histogram.total
+
+
+def summarize(histograms, empty, duration):
+    commands = dict()
+    for command, histogram in histograms.items():
+        if not histogram.count:
+            continue
+        commands[command] = {
+            "count": histogram.count,
+            "throughput": histogram.count / duration,
+            **{
+                f"{name}_us": histogram.percentile(fraction) * 1e6
+                for name, fraction in PERCENTILES.items()
+            },
+        }
+    if "GET" in commands:
+        commands["GET"]["empty"] = empty
+    total = sum(command["count"] for command in commands.values())
+    return {"throughput": total / duration, "commands": commands}
+
+
+def bench(size, args):
+    mode = ["-w", str(args.workers)] if args.workers > 1 else ["-a"]
+    with running_server(args.ip, args.port, *mode):
+        payload = b"x" * args.payload
+        asyncio.run(preload(args.ip, args.port, size, payload))
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.starmap(
+                run_client,
+                [
+                    (
+                        args.ip,
+                        args.port,
+                        args.connections,
+                        args.weights,
+                        payload,
+                        args.duration,
+                    )
+                ]
+                * args.clients,
+            )
+    histograms = {command: Histogram() for command in ("ADD", "GET", "ACK")}
+    for client_histograms, _ in results:
+        merge(histograms, client_histograms)
+    empty = sum(client_empty for _, client_empty in results)
+    return {"size": size, **summarize(histograms, empty, args.duration)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline):
+    baseline = {result["size"]: result for result in baseline or []}
+    print(
+        f"{'size':>10} {'command':>8} {'ops/s':>10} {'p50, us':>10}"
+        f" {'p99, us':>10} {'p999, us':>10} {'vs base':>8}"
+    )
+    for result in results:
+        for command, stats in result["commands"].items():
+            base = baseline.get(result["size"], {}).get("commands", {}).get(command)
+            ratio = f"{stats['throughput'] / base['throughput']:>8.2f}" if base else ""
+            print(
+                f"{result['size']:>10} {command:>8} {stats['throughput']:>10.0f}"
+                f" {stats['p50_us']:>10.1f} {stats['p99_us']:>10.1f}"
+                f" {stats['p999_us']:>10.1f} {ratio}"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Drives a local task queue server with a mix of ADD, GET and ACK"
+        " from many clients and reports throughput and latency against queue size"
+    )
+    parser.add_argument(
+        "-s",
+        action="store",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=[0, 10_000, 100_000],
+        help="Tasks preloaded into the queue before each run",
+    )
+    parser.add_argument(
+        "-x",
+        action="store",
+        dest="mix",
+        type=str,
+        nargs="+",
+        default=["ADD=1", "GET=1", "ACK=1"],
+        help="Command weights, like ADD=2 GET=1 ACK=1",
+    )
+    parser.add_argument(
+        "-n",
+        action="store",
+        dest="clients",
+        type=int,
+        default=os.cpu_count(),
+        help="Client processes generating load",
+    )
+    parser.add_argument(
+        "-k",
+        action="store",
+        dest="connections",
+        type=int,
+        default=16,
+        help="Connections per client process",
+    )
+    parser.add_argument(
+        "-l",
+        action="store",
+        dest="payload",
+        type=int,
+        default=100,
+        help="Payload size in bytes",
+    )
+    parser.add_argument(
+        "-t",
+        action="store",
+        dest="duration",
+        type=float,
+        default=5.0,
+        help="Seconds to run each queue size",
+    )
+    parser.add_argument(
+        "-w",
+        action="store",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Server worker processes, 1 runs the asyncio server",
+    )
+    parser.add_argument(
+        "-o",
+        action="store",
+        dest="output",
+        type=str,
+        default=None,
+        help="Write the results as JSON to this file",
+    )
+    parser.add_argument(
+        "-b",
+        action="store",
+        dest="baseline",
+        type=str,
+        default=None,
+        help="JSON results of an earlier run to compare throughput with",
+    )
+    parser.add_argument(
+        "-p", action="store", dest="port", type=int, default=5555, help="Server port"
+    )
+    parser.add_argument(
+        "-i", action="store", dest="ip", type=str, default="127.0.0.1", help="Server ip"
+    )
+    args = parser.parse_args()
+    args.weights = parse_mix(args.mix)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [bench(size, args) for size in args.sizes]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.output:
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {
+                name: getattr(args, name)
+                for name in (
+                    "mix",
+                    "clients",
+                    "connections",
+                    "payload",
+                    "duration",
+                    "workers",
+                )
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,94 @@
+import argparse
+import os
+import resource
+
+from bench_server import connect, running_server
+from binary_protocol import HEADER, MAGIC, Opcode, pack_string
+
+
+def run_text(s, payload, messages):
+    responses = s.makefile("rb")
+    add = b"ADD bench %d %s\n" % (len(payload), payload)
+    for _ in range(messages):
+        s.sendall(add)
+        responses.readline()
+        s.sendall(b"GET bench\n")
+        task_id, length, data = responses.readline().split(b" ", 2)
+        # The payload may contain newlines, read up to its declared length.
+        responses.read(int(length) + 1 - len(data))
+
+
+def run_binary(s, payload, messages):
+    s.sendall(MAGIC)
+    responses = s.makefile("rb")
+    responses.read(len(MAGIC))
+    queue = pack_string(b"bench")
+    add = HEADER.pack(Opcode.ADD, len(queue) + len(payload)) + queue + payload
+    get = HEADER.pack(Opcode.GET, len(queue)) + queue
+    for _ in range(messages):
+        for request in (add, get):
+            s.sendall(request)
+            _, length = HEADER.unpack(responses.read(HEADER.size))
+            responses.read(length)
+
+
+def run_idle(s, payload, messages):
+    pass
+
+
+def server_cpu(protocol, payload, args):
+    """Returns the CPU seconds a fresh server process spent on `protocol`.
+
+    The server runs as a child process, its CPU time is taken from rusage
+    once it has exited.
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with running_server(args.ip, args.port, "-a"):
+        s = connect(args.ip, args.port)
+        protocol(s, payload, args.messages)
+        s.close()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares server CPU per message of the text and binary protocols"
+    )
+    parser.add_argument(
+        "-s",
+        action="store",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=[100, 10_000, 100_000, 1_000_000],
+        help="Payload sizes in bytes",
+    )
+    parser.add_argument(
+        "-n",
+        action="store",
+        dest="messages",
+        type=int,
+        default=2_000,
+        help="ADD+GET pairs sent per payload size",
+    )
+    parser.add_argument(
+        "-p", action="store", dest="port", type=int, default=5555, help="Server port"
+    )
+    parser.add_argument(
+        "-i", action="store", dest="ip", type=str, default="127.0.0.1", help="Server ip"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    startup = server_cpu(run_idle, b"", args)
+    print(f"{'payload':>10} {'text, us':>10} {'binary, us':>11} {'ratio':>6}")
+    for size in args.sizes:
+        payload = os.urandom(size)
+        text, binary = (
+            (server_cpu(protocol, payload, args) - startup) / args.messages * 1e6
+            for protocol in (run_text, run_binary)
+        )
+        print(f"{size:>10} {text:>10.1f} {binary:>11.1f} {binary / text:>6.2f}")
@@ -0,0 +1,142 @@
+import argparse
+import gc
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from server import Queue, TaskQueue
+
+
+def measure(operation, count):
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+    )
+
+
+def bench(size, samples, deadline, priorities):
+    queue = Queue()
+
+    def priority():
+        return random.randint(-100, 100) if priorities else 0
+
+    for _ in range(size):
+        queue.add("12345", priority())
+    # Finish half of the history so lookups also run over a long tail of
+    # ACKed tasks, like a queue that has been serving for a while.
+    for _ in range(size // 2):
+        queue.ack(queue.get(deadline).task_id)
+
+    taken = []
+    results = {
+        "ADD": measure(lambda i: queue.add("12345", priority()), samples),
+        "GET": measure(lambda i: taken.append(queue.get(deadline)), samples),
+        "IN": measure(lambda i: taken[i].task_id in queue, samples),
+        "ACK": measure(lambda i: queue.ack(taken[i].task_id), samples),
+    }
+    return results
+
+
+def bench_memory(size, payload_size, spill_threshold):
+    """Returns bytes of Python heap per queued task and per ACKed task."""
+    payload = b"x" * payload_size
+    with tempfile.TemporaryDirectory() as data_dir:
+        task_queue = TaskQueue(
+            data_dir,
+            300,
+            fsync_batch=size,
+            snapshot_every=size * 10,
+            spill_threshold=spill_threshold,
+        )
+        gc.collect()
+        tracemalloc.start()
+        # Every task gets a payload object of its own, like a received one.
+        for _ in range(size):
+            task_queue.add("bench", payload[:-1] + b"x")
+        queued, _ = tracemalloc.get_traced_memory()
+        for _ in range(size):
+            task_queue.ack("bench", task_queue.get("bench").task_id)
+        task_queue.leases.clear()
+        gc.collect()
+        acked, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        task_queue.close()
+    return queued / size, acked / size
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measures per-command latency of Queue against history size"
+    )
+    parser.add_argument(
+        "-s",
+        action="store",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000],
+        help="Queue sizes to benchmark",
+    )
+    parser.add_argument(
+        "-n",
+        action="store",
+        dest="samples",
+        type=int,
+        default=10_000,
+        help="Commands measured per size",
+    )
+    parser.add_argument(
+        "-r",
+        action="store_true",
+        dest="priorities",
+        default=False,
+        help="Add tasks with random priorities, so they go through the heap",
+    )
+    parser.add_argument(
+        "-m",
+        action="store_true",
+        dest="memory",
+        default=False,
+        help="Report heap bytes per task for 100B and 256KB payloads instead",
+    )
+    return parser.parse_args()
+
+
+def print_memory(sizes):
+    print(f"{'size':>10} {'payload':>8} {'spill':>6} {'queued, B':>10} {'ACKed, B':>9}")
+    for size in sizes:
+        for payload_size, spill_threshold in (
+            (100, 0),
+            (256 * 1024, 0),
+            (256 * 1024, 64 * 1024),
+        ):
+            if payload_size * size > 256 * 1024 * 1024:
+                continue
+            queued, acked = bench_memory(size, payload_size, spill_threshold)
+            print(
+                f"{size:>10} {payload_size:>8} {bool(spill_threshold)!s:>6}"
+                f" {queued:>10.1f} {acked:>9.1f}"
+            )
+
+
+def print_latency(sizes, samples, priorities):
+    print(f"{'size':>10} {'command':>8} {'p50, us':>10} {'p99, us':>10}")
+    for size in sizes:
+        for command, (p50, p99) in bench(size, samples, 300.0, priorities).items():
+            print(f"{size:>10} {command:>8} {p50:>10.2f} {p99:>10.2f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.memory:
+        print_memory(args.sizes)
+    else:
+        print_latency(args.sizes, args.samples, args.priorities)
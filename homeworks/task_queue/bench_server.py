@@ -0,0 +1,41 @@
+"""Starting and reaching the server under benchmark, shared by the bench_* scripts."""
+
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_PATH = os.path.join(os.path.dirname(__file__), "server.py")
+
+
+def connect(ip, port, attempts=100):
+    """Connects to the server, retrying while it is still starting up."""
+    for _ in range(attempts):
+        try:
+            return socket.create_connection((ip, port))
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def wait_for_port(ip, port, attempts=100):
+    connect(ip, port, attempts).close()
+
+
+@contextlib.contextmanager
+def running_server(ip, port, *options):
+    """Runs server.py with `options` on a fresh data directory until the block
+    exits, and waits for the process to finish."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = subprocess.Popen(
+            [sys.executable, SERVER_PATH, "-p", str(port), "-c", data_dir, *options]
+        )
+        try:
+            wait_for_port(ip, port)
+            yield server
+        finally:
+            server.terminate()
+            server.wait()
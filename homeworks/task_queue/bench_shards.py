@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+
+from bench_server import running_server
+from binary_protocol import shard_of
+
+
+async def drive_connection(ip, port, queues, depth, until):
+    reader, writer = await asyncio.open_connection(ip, port)
+    done = 0
+    while time.monotonic() < until:
+        # Each round pipelines `depth` ADD/GET pairs over many queues.
+        for i in range(depth):
+            queue = queues[(done + i) % len(queues)]
+            writer.write(b"ADD %s 1 x\nGET %s\n" % (queue, queue))
+        for _ in range(2 * depth):
+            await reader.readline()
+        done += 2 * depth
+    writer.close()
+    return done
+
+
+async def drive(ip, targets, connections, depth, duration):
+    until = time.monotonic() + duration
+    counts = await asyncio.gather(
+        *(
+            drive_connection(ip, *targets[i % len(targets)], depth, until)
+            for i in range(connections)
+        )
+    )
+    return sum(counts)
+
+
+def run_client(ip, port, client, queues, connections, depth, duration, shards):
+    """Runs one client process. With `shards` the queues of a connection all
+    belong to one shard, and it connects to that shard's own port."""
+    names = [b"bench-%d-%d" % (client, i) for i in range(queues)]
+    targets = [(port, names)]
+    if shards:
+        owned = [[] for _ in range(shards)]
+        for name in names:
+            owned[shard_of(name, shards)].append(name)
+        targets = [
+            (port + 1 + shard, queues) for shard, queues in enumerate(owned) if queues
+        ]
+    return asyncio.run(drive(ip, targets, connections, depth, duration))
+
+
+def bench(workers, args):
+    mode = ["-w", str(workers)] if workers > 1 else ["-a"]
+    with running_server(args.ip, args.port, *mode):
+        with multiprocessing.Pool(args.clients) as pool:
+            counts = pool.starmap(
+                run_client,
+                [
+                    (
+                        args.ip,
+                        args.port,
+                        client,
+                        args.queues,
+                        args.connections,
+                        args.depth,
+                        args.duration,
+                        workers if args.route and workers > 1 else None,
+                    )
+                    for client in range(args.clients)
+                ],
+            )
+    return sum(counts) / args.duration
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measures task queue throughput against the number of shards"
+    )
+    parser.add_argument(
+        "-w",
+        action="store",
+        dest="workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Worker counts to benchmark",
+    )
+    parser.add_argument(
+        "-n",
+        action="store",
+        dest="clients",
+        type=int,
+        default=os.cpu_count(),
+        help="Client processes generating load",
+    )
+    parser.add_argument(
+        "-k",
+        action="store",
+        dest="connections",
+        type=int,
+        default=16,
+        help="Connections per client process",
+    )
+    parser.add_argument(
+        "-q",
+        action="store",
+        dest="queues",
+        type=int,
+        default=64,
+        help="Queues per client process",
+    )
+    parser.add_argument(
+        "-d",
+        action="store",
+        dest="depth",
+        type=int,
+        default=32,
+        help="Pipelined ADD/GET pairs per connection",
+    )
+    parser.add_argument(
+        "-t",
+        action="store",
+        dest="duration",
+        type=float,
+        default=5.0,
+        help="Seconds to run each benchmark",
+    )
+    parser.add_argument(
+        "-r",
+        action="store_true",
+        dest="route",
+        default=False,
+        help="Send the commands of a queue straight to the port of its shard",
+    )
+    parser.add_argument(
+        "-p", action="store", dest="port", type=int, default=5555, help="Server port"
+    )
+    parser.add_argument(
+        "-i", action="store", dest="ip", type=str, default="127.0.0.1", help="Server ip"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"{'workers':>8} {'commands/s':>12} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        throughput = bench(workers, args)
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>12.0f} {throughput / baseline:>8.2f}")
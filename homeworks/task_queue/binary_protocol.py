@@ -0,0 +1,108 @@
+"""Length-prefixed binary protocol of the task queue server.
+
+A client switches its connection to this protocol by sending MAGIC as the
+very first bytes, the server confirms by sending MAGIC back. After that
+every request is a HEADER with an opcode and the body length followed by
+the body, and every response is a HEADER with a status and the body length
+followed by the body.
+
+Strings (queue names and task ids) are prefixed with their length as
+STRING_LENGTH, payloads inside MADD and MGET bodies with PAYLOAD_LENGTH:
+
+    ADD   request: queue, payload up to the end of the body
+          response: task id up to the end of the body
+    SCHEDULE request: queue, SCHEDULE (priority, not-before Unix time),
+          payload up to the end of the body
+          response: as for ADD
+    MADD  request: queue, (payload length, payload) until the end
+          response: task id strings
+    GET   request: queue, optional WAIT in milliseconds
+          response: task id, payload up to the end of the body
+    MGET  request: queue, count
+          response: (task id, payload length, payload) for every task
+    ACK   request: queue, task id
+    IN    request: queue, task id
+    SAVE  request: empty
+    STATS request: empty
+          response: metrics in the Prometheus text format
+    PROMOTE request: empty
+
+ACK, IN, SAVE and PROMOTE answer with the status alone. GET and MGET answer
+NO when there is nothing to hand out, a GET with WAIT first waits that long
+for a task to be added or to come back from an expired lease.
+
+A server started with -w N splits queues among N shards by `shard_of`.
+Shard i also takes clients on port + 1 + i, where requests for its own
+queues are not forwarded to another shard.
+"""
+
+import struct
+import zlib
+from enum import IntEnum
+
+MAGIC = b"\x00TQB"
+HEADER = struct.Struct("!BI")
+STRING_LENGTH = struct.Struct("!H")
+PAYLOAD_LENGTH = struct.Struct("!I")
+WAIT = struct.Struct("!I")
+SCHEDULE = struct.Struct("!id")
+
+
+DEAD_LETTER_SUFFIX = ".dlq"
+
+
+class Opcode(IntEnum):
+    ADD = 1
+    MADD = 2
+    GET = 3
+    MGET = 4
+    ACK = 5
+    IN = 6
+    SAVE = 7
+    STATS = 8
+    SCHEDULE = 9
+    PROMOTE = 10
+
+
+class Status(IntEnum):
+    OK = 0
+    NO = 1
+    ERROR = 2
+
+
+def shard_of(queue, shards):
+    """Returns the shard that owns the queue named `queue` (bytes)."""
+    # crc32 rather than hash(): it has to agree between processes.
+    # A dead letter queue lives on the shard of the queue it is fed from.
+    return zlib.crc32(queue.removesuffix(DEAD_LETTER_SUFFIX.encode())) % shards
+
+
+def pack_string(value):
+    return STRING_LENGTH.pack(len(value)) + value
+
+
+def pack_payload(value):
+    return PAYLOAD_LENGTH.pack(len(value)) + value
+
+
+def unpack_string(view, offset):
+    """Returns the string at `offset` of a memoryview and the offset after it."""
+    (length,) = STRING_LENGTH.unpack_from(view, offset)
+    start = offset + STRING_LENGTH.size
+    if start + length > len(view):
+        raise ValueError("String runs past the end of the frame")
+    return view[start : start + length], start + length
+
+
+def unpack_payload(view, offset):
+    """Returns the payload at `offset` of a memoryview and the offset after it."""
+    (length,) = PAYLOAD_LENGTH.unpack_from(view, offset)
+    start = offset + PAYLOAD_LENGTH.size
+    if start + length > len(view):
+        raise ValueError("Payload runs past the end of the frame")
+    return view[start : start + length], start + length
+
+
+def frame(code, chunks):
+    """Returns the chunks of a whole frame, ready for `writelines`."""
+    return [HEADER.pack(code, sum(map(len, chunks))), *chunks]
@@ -0,0 +1,425 @@
+"""Client library of the task queue server.
+
+Talks the binary protocol, so it needs a server started with -a or -w.
+AsyncClient is the asyncio API, Client wraps it for threads:
+
+    with Client("127.0.0.1", 5555) as client:
+        task_id = client.add("jobs", b"payload")
+        task = client.get("jobs", wait=10)
+        client.ack("jobs", task.task_id)
+
+Requests share a pool of pipelined connections, the requests of one queue
+always go over the same one and run in the order made. ADDs of one queue
+that are outstanding at the same time are sent as a single MADD, a
+long-polling GET takes a connection of its own. Connections that break are reopened with
+exponential backoff. Requests in flight on a broken connection fail with
+ConnectionError, since the server may or may not have executed them.
+
+Given `shards`, the worker count of a server started with -w, requests of
+a queue go straight to the shard that owns it rather than through one that
+forwards them. Long-polling GETs still take any shard.
+"""
+
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import NamedTuple
+
+from binary_protocol import (
+    HEADER,
+    MAGIC,
+    PAYLOAD_LENGTH,
+    SCHEDULE,
+    WAIT,
+    Opcode,
+    Status,
+    pack_payload,
+    pack_string,
+    shard_of,
+    unpack_payload,
+    unpack_string,
+)
+
+
+class ServerError(Exception):
+    """The server could not execute a request."""
+
+
+class Task(NamedTuple):
+    task_id: str
+    data: bytes
+
+
+class Connection:
+    """One pipelined binary protocol connection, answers come back in order.
+
+    Requests made while the connection is still opening are buffered and
+    written once it is open, so they always go out in the order made.
+    """
+
+    def __init__(self):
+        self.writer = None
+        self.unsent = []
+        self.waiters = deque()
+        self.closed = False
+        self.opening = None
+
+    async def open(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(MAGIC)
+        try:
+            magic = await reader.readexactly(len(MAGIC))
+        except asyncio.IncompleteReadError:
+            magic = None
+        if magic != MAGIC:
+            writer.close()
+            raise ConnectionError("Server does not speak the binary protocol")
+        self.writer = writer
+        self.writer.writelines(self.unsent)
+        self.unsent = []
+        self.reader_task = asyncio.create_task(self.read_responses(reader))
+
+    async def read_responses(self, reader):
+        try:
+            while True:
+                status, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                body = await reader.readexactly(length)
+                waiter = self.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result((status, body))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        self.writer.close()
+        self.abort(ConnectionError("Connection to server lost"))
+
+    def abort(self, error):
+        """Fails the requests waiting for an answer with `error`."""
+        self.closed = True
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(error)
+
+    def request(self, opcode, body):
+        """Writes a request at once and returns an awaitable of its answer."""
+        if self.closed:
+            raise ConnectionError("Connection to server lost")
+        response = asyncio.get_running_loop().create_future()
+        self.waiters.append(response)
+        chunks = [HEADER.pack(opcode, len(body)), body]
+        if self.writer is None:
+            self.unsent += chunks
+        else:
+            self.writer.writelines(chunks)
+        return self.answer(response)
+
+    async def answer(self, response):
+        if self.writer is not None:
+            await self.writer.drain()
+        return await response
+
+    async def close(self):
+        self.closed = True
+        if self.opening is not None and not self.opening.done():
+            self.opening.cancel()
+            await asyncio.gather(self.opening, return_exceptions=True)
+            self.abort(ConnectionError("Connection closed"))
+        if self.writer is not None:
+            self.writer.close()
+            await asyncio.gather(
+                self.reader_task, self.writer.wait_closed(), return_exceptions=True
+            )
+
+
+def check(status):
+    if status == Status.ERROR:
+        raise ServerError("Server could not execute the request")
+    return status == Status.OK
+
+
+def unpack_task_ids(body):
+    view = memoryview(body)
+    task_ids = []
+    offset = 0
+    while offset < len(view):
+        task_id, offset = unpack_string(view, offset)
+        task_ids.append(str(task_id, "ascii"))
+    return task_ids
+
+
+def unpack_added(count, status, body):
+    """Returns the ids of `count` tasks added with one ADD or MADD."""
+    check(status)
+    if count == 1:
+        return [str(body, "ascii")]
+    return unpack_task_ids(body)
+
+
+def unpack_task(body):
+    view = memoryview(body)
+    task_id, offset = unpack_string(view, 0)
+    return Task(str(task_id, "ascii"), bytes(view[offset:]))
+
+
+class AsyncClient:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=5555,
+        pool_size=4,
+        max_batch=1000,
+        connect_attempts=10,
+        backoff=0.05,
+        max_backoff=2.0,
+        shards=None,
+    ):
+        self.host = host
+        self.port = port
+        # With the number of shards of a -w server, requests of a queue go
+        # straight to its shard, each shard gets a pool of its own.
+        self.shards = shards
+        self.max_batch = max_batch
+        self.connect_attempts = connect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.pool_size = pool_size
+        self.connections = [None] * pool_size * (shards or 1)
+        self.next_connection = itertools.cycle(range(pool_size))
+        # Connections of long-polling GETs, kept for the next one.
+        self.idle = []
+        # Queue name -> [(payload, future)] of ADDs waiting to be sent.
+        self.pending = dict()
+        self.flush_scheduled = False
+        self.batches = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def connect(self, port=None):
+        """Returns a new connection, it opens in the background."""
+        connection = Connection()
+        connection.opening = asyncio.create_task(
+            self.open(connection, port or self.port)
+        )
+        return connection
+
+    async def open(self, connection, port):
+        """Opens `connection`, retrying with exponential backoff."""
+        delay = self.backoff
+        for attempt in range(self.connect_attempts):
+            try:
+                await connection.open(self.host, port)
+                return
+            except OSError as e:
+                error = e
+            if attempt < self.connect_attempts - 1:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        connection.abort(ConnectionError(f"Could not connect to server: {error}"))
+
+    def request(self, opcode, body=b"", queue=None):
+        """Writes a request at once and returns an awaitable of its answer.
+
+        ADDs to `queue` still waiting for their batch are written first.
+        """
+        if queue in self.pending:
+            self.flush(queue)
+        # Requests of a queue share a connection, so they run in the order made.
+        if queue is None:
+            index = next(self.next_connection)
+        else:
+            index = hash(queue) % self.pool_size
+        port = None
+        if self.shards and queue is not None:
+            shard = shard_of(queue.encode(), self.shards)
+            index += shard * self.pool_size
+            port = self.port + 1 + shard
+        connection = self.connections[index]
+        if connection is None or connection.closed:
+            connection = self.connections[index] = self.connect(port)
+        return connection.request(opcode, body)
+
+    async def add(self, queue, data, priority=0, not_before=0.0):
+        """Adds a task and returns its id.
+
+        Plain ADDs are batched with the other ADDs to `queue` that are
+        outstanding at the same time.
+        """
+        if priority or not_before:
+            body = pack_string(queue.encode()) + SCHEDULE.pack(priority, not_before)
+            status, task_id = await self.request(Opcode.SCHEDULE, body + data, queue)
+            check(status)
+            return str(task_id, "ascii")
+        future = asyncio.get_running_loop().create_future()
+        pending = self.pending.setdefault(queue, [])
+        pending.append((data, future))
+        if len(pending) >= self.max_batch:
+            self.flush(queue)
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush_all)
+        return await future
+
+    def flush_all(self):
+        self.flush_scheduled = False
+        for queue in list(self.pending):
+            self.flush(queue)
+
+    def flush(self, queue):
+        pending = self.pending.pop(queue)
+        answer = self.send_adds(queue, [data for data, _ in pending])
+        batch = asyncio.create_task(self.send_batch(pending, answer))
+        self.batches.add(batch)
+        batch.add_done_callback(self.batches.discard)
+
+    async def send_batch(self, pending, answer):
+        try:
+            task_ids = unpack_added(len(pending), *await answer)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), task_id in zip(pending, task_ids):
+            if not future.done():
+                future.set_result(task_id)
+
+    async def add_many(self, queue, payloads):
+        """Adds tasks with one MADD and returns their ids."""
+        return unpack_added(len(payloads), *await self.send_adds(queue, payloads))
+
+    def send_adds(self, queue, payloads):
+        name = pack_string(queue.encode())
+        if len(payloads) == 1:
+            return self.request(Opcode.ADD, name + payloads[0], queue)
+        body = b"".join([name, *map(pack_payload, payloads)])
+        return self.request(Opcode.MADD, body, queue)
+
+    async def get(self, queue, wait=None):
+        """Leases the next task of `queue`, None if there is none.
+
+        With `wait` the server holds the request up to that many seconds
+        until a task shows up.
+        """
+        body = pack_string(queue.encode())
+        if not wait:
+            status, task = await self.request(Opcode.GET, body, queue)
+            return unpack_task(task) if check(status) else None
+        if queue in self.pending:
+            self.flush(queue)
+        # A parked GET would hold up everything pipelined behind it.
+        connection = self.idle.pop() if self.idle else self.connect()
+        try:
+            status, task = await connection.request(
+                Opcode.GET, body + WAIT.pack(int(wait * 1000))
+            )
+        finally:
+            if not connection.closed:
+                self.idle.append(connection)
+        return unpack_task(task) if check(status) else None
+
+    async def get_many(self, queue, count):
+        body = pack_string(queue.encode()) + PAYLOAD_LENGTH.pack(count)
+        status, tasks = await self.request(Opcode.MGET, body, queue)
+        if not check(status):
+            return []
+        view = memoryview(tasks)
+        result = []
+        offset = 0
+        while offset < len(view):
+            task_id, offset = unpack_string(view, offset)
+            data, offset = unpack_payload(view, offset)
+            result.append(Task(str(task_id, "ascii"), bytes(data)))
+        return result
+
+    async def ack(self, queue, task_id):
+        body = pack_string(queue.encode()) + pack_string(task_id.encode())
+        status, _ = await self.request(Opcode.ACK, body, queue)
+        return check(status)
+
+    async def contains(self, queue, task_id):
+        body = pack_string(queue.encode()) + pack_string(task_id.encode())
+        status, _ = await self.request(Opcode.IN, body, queue)
+        return check(status)
+
+    async def save(self):
+        status, _ = await self.request(Opcode.SAVE)
+        check(status)
+
+    async def stats(self):
+        status, stats = await self.request(Opcode.STATS)
+        check(status)
+        return stats.decode()
+
+    async def close(self):
+        self.flush_all()
+        if self.batches:
+            await asyncio.wait(self.batches)
+        connections = [c for c in self.connections if c is not None] + self.idle
+        await asyncio.gather(*(connection.close() for connection in connections))
+        self.connections = [None] * len(self.connections)
+        self.idle = []
+
+
+class Client:
+    """Thread-safe blocking client.
+
+    Runs an AsyncClient on an event loop of its own, so ADDs from many
+    threads, or from `add_nowait`, are batched together.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = AsyncClient(*args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def add(self, queue, data, priority=0, not_before=0.0):
+        return self.submit(self.client.add(queue, data, priority, not_before)).result()
+
+    def add_nowait(self, queue, data, priority=0, not_before=0.0):
+        """Adds a task in the background, returns a Future of its id."""
+        return self.submit(self.client.add(queue, data, priority, not_before))
+
+    def add_many(self, queue, payloads):
+        return self.submit(self.client.add_many(queue, payloads)).result()
+
+    def get(self, queue, wait=None):
+        return self.submit(self.client.get(queue, wait)).result()
+
+    def get_many(self, queue, count):
+        return self.submit(self.client.get_many(queue, count)).result()
+
+    def ack(self, queue, task_id):
+        return self.submit(self.client.ack(queue, task_id)).result()
+
+    def contains(self, queue, task_id):
+        return self.submit(self.client.contains(queue, task_id)).result()
+
+    def save(self):
+        return self.submit(self.client.save()).result()
+
+    def stats(self):
+        return self.submit(self.client.stats()).result()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.submit(self.client.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
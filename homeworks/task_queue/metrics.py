@@ -0,0 +1,163 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Octaves of microseconds, enough for any duration without a range check.
+OCTAVES = 64
+
+
+class Histogram:
+    """Log-linear histogram of durations in the spirit of HdrHistogram.
+
+    Durations are counted in microseconds, every power of two is split into
+    SUB_BUCKETS linear buckets, so a recorded value is off by at most
+    1/SUB_BUCKETS. Recording is a few integer operations and an increment.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (OCTAVES * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    @staticmethod
+    def upper_bound(index):
+        """Returns the microseconds right above the bucket at `index`."""
+        exponent = max((index >> SUB_BUCKET_BITS) - 1, 0)
+        return (index - (exponent << SUB_BUCKET_BITS) + 1) << exponent
+
+    def record(self, nanoseconds):
+        microseconds = nanoseconds // 1000
+        exponent = microseconds.bit_length() - SUB_BUCKET_BITS - 1
+        if exponent < 0:
+            exponent = 0
+        self.counts[(exponent << SUB_BUCKET_BITS) + (microseconds >> exponent)] += 1
+        self.count += 1
+        self.total += nanoseconds
+
+    def percentile(self, fraction):
+        """Returns the upper bound in seconds of the `fraction` quantile."""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.upper_bound(index) / 1e6
+        return 0.0
+
+    def octaves(self):
+        """Yields (upper bound in seconds, cumulative count) per power of two."""
+        seen = 0
+        for octave in range(OCTAVES):
+            start = octave * SUB_BUCKETS
+            seen += sum(self.counts[start : start + SUB_BUCKETS])
+            yield self.upper_bound(start + SUB_BUCKETS - 1) / 1e6, seen
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = (f'{name}="{escape(value)}"' for name, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_sample(name, value, labels):
+    return f"{name}{format_labels(labels)} {value}"
+
+
+def format_histogram(name, histogram, labels):
+    lines = []
+    for bound, count in histogram.octaves():
+        lines.append(format_sample(f"{name}_bucket", count, {**labels, "le": bound}))
+        if count == histogram.count:
+            break
+    lines += [
+        format_sample(f"{name}_bucket", histogram.count, {**labels, "le": "+Inf"}),
+        format_sample(f"{name}_sum", histogram.total / 1e9, labels),
+        format_sample(f"{name}_count", histogram.count, labels),
+    ]
+    return lines
+
+
+class Metrics:
+    """Counters and histograms of one TaskQueue.
+
+    The server updates them from its only thread and the exporter thread
+    just reads them, so plain integers and lists do without locks. A scrape
+    may be a few commands behind, which is fine for monitoring.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.commands = dict()
+        self.errors = dict()
+        self.expired = 0
+        self.dead_lettered = 0
+        self.wal_commits = Histogram()
+        self.snapshots = Histogram()
+
+    def record(self, command, nanoseconds, error=False):
+        histogram = self.commands.get(command)
+        if histogram is None:
+            histogram = self.commands[command] = Histogram()
+        histogram.record(nanoseconds)
+        if error:
+            self.errors[command] = self.errors.get(command, 0) + 1
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format as lines."""
+        labels = self.labels
+        lines = ["# TYPE taskqueue_command_seconds histogram"]
+        for command, histogram in list(self.commands.items()):
+            lines += format_histogram(
+                "taskqueue_command_seconds", histogram, {**labels, "command": command}
+            )
+        lines.append("# TYPE taskqueue_command_errors_total counter")
+        for command, count in list(self.errors.items()):
+            lines.append(
+                format_sample(
+                    "taskqueue_command_errors_total",
+                    count,
+                    {**labels, "command": command},
+                )
+            )
+        lines += [
+            "# TYPE taskqueue_leases_expired_total counter",
+            format_sample("taskqueue_leases_expired_total", self.expired, labels),
+            "# TYPE taskqueue_dead_lettered_total counter",
+            format_sample("taskqueue_dead_lettered_total", self.dead_lettered, labels),
+            "# TYPE taskqueue_wal_commit_seconds histogram",
+            *format_histogram("taskqueue_wal_commit_seconds", self.wal_commits, labels),
+            "# TYPE taskqueue_snapshot_seconds histogram",
+            *format_histogram("taskqueue_snapshot_seconds", self.snapshots, labels),
+        ]
+        return lines
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(ip, port, render):
+    """Serves `render()` over HTTP from a background thread.
+
+    Returns the HTTP server, `shutdown` it to stop the thread.
+    """
+    server = ThreadingHTTPServer((ip, port), MetricsHandler)
+    server.daemon_threads = True
+    server.render = render
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
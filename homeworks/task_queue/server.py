@@ -1,11 +1,40 @@
 import argparse
+import asyncio
+import heapq
+import io
+import math
+import multiprocessing
 import os
 import pickle
+import signal
 import socketserver
+import struct
+import sys
 import time
+from collections import deque
 from dataclasses import dataclass, field
 from enum import Enum
 
+from binary_protocol import (
+    DEAD_LETTER_SUFFIX,
+    HEADER,
+    MAGIC,
+    PAYLOAD_LENGTH,
+    SCHEDULE,
+    WAIT,
+    Opcode,
+    Status,
+    frame,
+    pack_payload,
+    pack_string,
+    shard_of,
+    unpack_payload,
+    unpack_string,
+)
+from metrics import Metrics, format_sample, start_exporter
+from spill import SpillStore, SpilledPayload
+from wal import SCHEDULE_OPTIONS, Op, WriteAheadLog, decode_body, encode_body
+
 
 class State(Enum):
     created = "created"
@@ -13,19 +42,719 @@ class State(Enum):
     finished = "finished"
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     task_id: str
-    data_length: str
-    data: str
-    taken_at: float = 0.0
+    data: bytes | memoryview | SpilledPayload
+    deadline: float = 0.0
     state: State = State.created.value
+    priority: int = 0
+    # Unix time before which the task is not handed out.
+    not_before: float = 0.0
+    deliveries: int = 0
+
+    def __getstate__(self):
+        # Binary ADD keeps the payload as a view of the receive buffer.
+        data = bytes(self.data) if isinstance(self.data, memoryview) else self.data
+        return (
+            self.task_id,
+            data,
+            self.deadline,
+            self.state,
+            self.priority,
+            self.not_before,
+            self.deliveries,
+        )
+
+    def __setstate__(self, state):
+        # Snapshots from older versions have fewer fields.
+        self.task_id, self.data, self.deadline, self.state, *rest = state
+        defaults = (0, 0.0, 0)
+        self.priority, self.not_before, self.deliveries = (
+            *rest,
+            *defaults[len(rest) :],
+        )
 
 
 @dataclass
 class Queue:
     max_id: int = 0
-    task_list: list[Task] = field(default_factory=list)
+    tasks: dict[str, Task] = field(default_factory=dict)
+    # Tasks without a priority in the order they were added.
+    ready: deque[Task] = field(default_factory=deque)
+    # Tasks with a priority and expired ones, by (-priority, id).
+    prioritized: list[tuple[int, int, Task]] = field(default_factory=list)
+    # Tasks not to be handed out yet, by (not before, id).
+    delayed: list[tuple[float, int, Task]] = field(default_factory=list)
+    running: int = 0
+
+    def __getstate__(self):
+        # Only the tasks are persisted, the indexes are rebuilt on load.
+        return {"max_id": self.max_id, "tasks": self.tasks}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def add(self, data, priority=0, not_before=0.0) -> Task:
+        task = Task(
+            task_id=str(self.max_id),
+            data=data,
+            priority=priority,
+            not_before=not_before,
+        )
+        self.max_id += 1
+        self.tasks[task.task_id] = task
+        self._enqueue(task, time.time() if not_before else 0.0)
+        return task
+
+    def _enqueue(self, task, now) -> None:
+        # Ids only grow, so plain tasks keep `ready` ordered by id.
+        if task.not_before > now:
+            heapq.heappush(self.delayed, (task.not_before, int(task.task_id), task))
+        elif task.priority:
+            self.prioritize(task)
+        else:
+            self.ready.append(task)
+
+    def prioritize(self, task) -> None:
+        heapq.heappush(self.prioritized, (-task.priority, int(task.task_id), task))
+
+    def requeue(self, task) -> None:
+        # Expired leases go to the heap, where tasks of the same priority are
+        # ordered by id, so they are handed out again in the order they were
+        # added.
+        task.state = State.created.value
+        self.running -= 1
+        self.prioritize(task)
+
+    def rebuild(self) -> list[Task]:
+        """Rebuilds the indexes from `tasks` and returns the running tasks."""
+        self.ready.clear()
+        self.prioritized.clear()
+        self.delayed.clear()
+        now = time.time()
+        running = []
+        for task in self.tasks.values():
+            if task.state == State.running.value:
+                running.append(task)
+            else:
+                self._enqueue(task, now)
+        self.running = len(running)
+        return running
+
+    def has_due(self, now) -> bool:
+        return bool(self.delayed) and self.delayed[0][0] <= now
+
+    def _release_due(self) -> None:
+        now = time.time()
+        while self.has_due(now):
+            task = heapq.heappop(self.delayed)[2]
+            if task.state == State.created.value:
+                self.prioritize(task)
+
+    def _next_ready(self) -> Task | None:
+        # Plain tasks in `ready` rank as priority 0, the smaller key of the
+        # two heads goes first. ACKed tasks are skipped lazily.
+        if self.delayed:
+            self._release_due()
+        prioritized = self.prioritized
+        while prioritized and prioritized[0][2].state != State.created.value:
+            heapq.heappop(prioritized)
+        while self.ready and self.ready[0].state != State.created.value:
+            self.ready.popleft()
+        if prioritized and (
+            not self.ready or prioritized[0][:2] < (0, int(self.ready[0].task_id))
+        ):
+            return heapq.heappop(prioritized)[2]
+        if self.ready:
+            return self.ready.popleft()
+        return None
+
+    def get(self, deadline) -> Task | None:
+        task = self._next_ready()
+        if task is not None:
+            task.state = State.running.value
+            task.deadline = deadline
+            task.deliveries += 1
+            self.running += 1
+        return task
+
+    def lease(self, task_id) -> Task:
+        """Marks a task leased by a primary, or before a restart, as running."""
+        task = self.tasks[task_id]
+        if task.state != State.running.value:
+            task.state = State.running.value
+            self.running += 1
+        task.deliveries += 1
+        return task
+
+    def ack(self, task_id) -> Task | None:
+        task = self.tasks.pop(task_id, None)
+        if task is not None:
+            if task.state == State.running.value:
+                self.running -= 1
+            task.state = State.finished.value
+        return task
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self.tasks
+
+
+class IncompleteMessage(ValueError):
+    def __init__(self, missing):
+        super().__init__(f"{missing} more bytes expected")
+        self.missing = missing
+
+
+def split_tasks(payload, count):
+    """Splits a MADD payload `<length> <data> <length> <data> ...` into pairs.
+
+    Raises IncompleteMessage when the payload ends before `count` tasks and
+    ValueError when it is malformed.
+    """
+    separator = b" "
+    tasks = []
+    offset = 0
+    for index in range(count):
+        if index > 0:
+            if offset == len(payload):
+                raise IncompleteMessage(len(" 0 "))
+            if payload[offset : offset + 1] != separator:
+                raise ValueError("Malformed task list")
+            offset += 1
+        space = payload.find(separator, offset)
+        length = payload[offset:space] if space >= 0 else payload[offset:]
+        if length and not length.isdigit():
+            raise ValueError("Malformed task list")
+        if space < 0:
+            raise IncompleteMessage(1 if length else len("0 "))
+        end = space + 1 + int(length)
+        if end > len(payload):
+            raise IncompleteMessage(end - len(payload))
+        tasks.append((length, payload[space + 1 : end]))
+        offset = end
+    return tasks
+
+
+def format_task(task_id, data):
+    return b"%s %d %s" % (bytes(task_id, "ascii"), len(data), data)
+
+
+TEXT_COMMANDS = {
+    command: str(command, "ascii")
+    for command in (b"ADD", b"MADD", b"GET", b"MGET", b"ACK", b"IN", b"SAVE", b"STATS")
+}
+BINARY_COMMANDS = {opcode: opcode.name for opcode in Opcode}
+
+
+def split_schedule(task_data, length):
+    """Splits `<data>[ <priority>[ <not before>]]` of an ADD command.
+
+    Returns the payload, the priority and the not-before Unix time.
+    """
+    task_data, options = task_data[:length], task_data[length:]
+    if options and not options[:1].isspace():
+        raise ValueError("Payload is longer than its length")
+    options = options.split()
+    if len(options) > 2:
+        raise ValueError("Too many ADD options")
+    priority = int(options[0]) if options else 0
+    not_before = float(options[1]) if len(options) > 1 else 0.0
+    if not -(2**31) <= priority < 2**31 or not math.isfinite(not_before):
+        raise ValueError("Priority or not-before time out of range")
+    return task_data, priority, not_before
+
+
+def parse_wait(wait):
+    """Returns the seconds a long-polling GET may wait for a task."""
+    seconds = float(wait)
+    if not math.isfinite(seconds):
+        raise ValueError("Wait must be a finite number of seconds")
+    return seconds
+
+
+class TaskQueue:
+    def __init__(
+        self,
+        path,
+        timeout,
+        fsync_batch=128,
+        fsync_interval=0.01,
+        snapshot_every=100_000,
+        spill_threshold=64 * 1024,
+        max_deliveries=0,
+    ):
+        self.path = os.path.join(path, "data.pkl")
+        self.timeout = timeout
+        self.snapshot_every = snapshot_every
+        self.max_deliveries = max_deliveries
+        self.tick_interval = max(fsync_interval, 0.001)
+
+        self.task_queue_data = dict()
+        # Every lease lasts `timeout` on a monotonic clock, so leases are
+        # appended in deadline order and a FIFO is enough to expire them.
+        self.leases = deque()
+        # Futures of long-polling consumers by queue, in the order they came.
+        self.parked = dict()
+        self.generation = 0
+        self.metrics = Metrics()
+        self.wal = WriteAheadLog(
+            os.path.join(path, "data.wal"),
+            fsync_batch,
+            fsync_interval,
+            commit_times=self.metrics.wal_commits,
+        )
+        self.spill = SpillStore(path, spill_threshold)
+        # Streams logged changes to standby servers, set by the asyncio server.
+        self.replication = None
+
+        self.load_data()
+
+    def execute(self, message):
+        """Executes one text protocol command and returns the response."""
+        started = time.perf_counter_ns()
+        command, *arguments = message.split(b" ", 3)
+        response = self.run_command(command, arguments)
+        self.metrics.record(
+            TEXT_COMMANDS.get(command, "UNKNOWN"),
+            time.perf_counter_ns() - started,
+            error=response == b"ERROR",
+        )
+        return response
+
+    def execute_binary(self, opcode, body):
+        """Executes one binary protocol request.
+
+        `body` is a memoryview of the request buffer, fields are sliced out
+        of it without copies. Returns the response status and body chunks.
+        """
+        started = time.perf_counter_ns()
+        status, chunks = self.run_binary(opcode, body)
+        self.metrics.record(
+            BINARY_COMMANDS.get(opcode, "UNKNOWN"),
+            time.perf_counter_ns() - started,
+            error=status == Status.ERROR,
+        )
+        return status, chunks
+
+    def run_command(self, command, arguments):
+        try:
+            match command:
+                case b"ADD":
+                    return self.add_command(*arguments)
+                case b"MADD":
+                    return self.madd_command(*arguments)
+                case b"GET":
+                    return self.get_command(*arguments)
+                case b"MGET":
+                    return self.mget_command(*arguments)
+                case b"ACK":
+                    return self.ack_command(*arguments)
+                case b"IN":
+                    return self.in_command(*arguments)
+                case b"SAVE":
+                    return self.save_command(*arguments)
+                case b"STATS":
+                    return self.stats_command(*arguments)
+        except (TypeError, ValueError):
+            pass
+        return b"ERROR"
+
+    def run_binary(self, opcode, body):
+        try:
+            if opcode == Opcode.SAVE:
+                self.save_data()
+                return Status.OK, []
+            if opcode == Opcode.STATS:
+                return Status.OK, [self.stats()]
+            queue, offset = unpack_string(body, 0)
+            queue = str(queue, "utf-8")
+            match opcode:
+                case Opcode.ADD:
+                    # The request buffer is not shared, the view is kept as is.
+                    task = self.add(queue, body[offset:])
+                    return Status.OK, [bytes(task.task_id, "ascii")]
+                case Opcode.SCHEDULE:
+                    priority, not_before = SCHEDULE.unpack_from(body, offset)
+                    if not math.isfinite(not_before):
+                        raise ValueError("Not-before time out of range")
+                    task = self.add(
+                        queue, body[offset + SCHEDULE.size :], priority, not_before
+                    )
+                    return Status.OK, [bytes(task.task_id, "ascii")]
+                case Opcode.MADD:
+                    tasks = []
+                    while offset < len(body):
+                        task_data, offset = unpack_payload(body, offset)
+                        tasks.append(bytes(task_data))
+                    return Status.OK, [
+                        pack_string(bytes(self.add(queue, data).task_id, "ascii"))
+                        for data in tasks
+                    ]
+                case Opcode.GET:
+                    return self.task_frame(self.get(queue))
+                case Opcode.MGET:
+                    (count,) = PAYLOAD_LENGTH.unpack_from(body, offset)
+                    chunks = []
+                    for _ in range(count):
+                        task = self.get(queue)
+                        if task is None:
+                            break
+                        chunks += [
+                            pack_string(bytes(task.task_id, "ascii")),
+                            pack_payload(self.payload(task)),
+                        ]
+                    return (Status.OK if chunks else Status.NO), chunks
+                case Opcode.ACK | Opcode.IN:
+                    task_id, _ = unpack_string(body, offset)
+                    task_id = str(task_id, "ascii")
+                    if opcode == Opcode.ACK:
+                        found = self.ack(queue, task_id)
+                    else:
+                        found = self.contains(queue, task_id)
+                    return (Status.OK if found else Status.NO), []
+        except (struct.error, ValueError):
+            pass
+        return Status.ERROR, []
+
+    def add(self, queue, task_data, priority=0, not_before=0.0):
+        task = self.apply_add(queue, task_data, priority, not_before)
+        # The WAL keeps the payload itself, even a spilled one: segments are
+        # only flushed on a snapshot. Replay spills it again.
+        if priority or not_before:
+            options = SCHEDULE_OPTIONS.pack(priority, not_before)
+            self.log(Op.SCHEDULE, queue, options, task_data)
+        else:
+            self.log(Op.ADD, queue, task_data)
+        if queue in self.parked:
+            self.hand_out(queue)
+        return task
+
+    def get(self, queue):
+        if queue not in self.task_queue_data:
+            return None
+        task = self.task_queue_data[queue].get(time.monotonic() + self.timeout)
+        if task is not None:
+            self.leases.append((task.deadline, queue, task))
+            self.log(Op.GET, queue, bytes(task.task_id, "ascii"))
+        return task
+
+    def ack(self, queue, task_id):
+        found = self.apply_ack(queue, task_id)
+        if found:
+            self.log(Op.ACK, queue, bytes(task_id, "ascii"))
+        return found
+
+    def park(self, queue, consumer):
+        """Parks a consumer future until `queue` has a task to hand out."""
+        self.parked.setdefault(queue, deque()).append(consumer)
+
+    def unpark(self, queue, consumer):
+        consumers = self.parked[queue]
+        consumers.remove(consumer)
+        if not consumers:
+            del self.parked[queue]
+
+    def hand_out(self, queue):
+        # Tasks go straight to the consumers parked the longest, so a GET that
+        # comes later can not overtake them.
+        consumers = self.parked[queue]
+        while consumers:
+            task = self.get(queue)
+            if task is None:
+                return
+            consumers.popleft().set_result(task)
+        del self.parked[queue]
+
+    def release_parked(self):
+        """Wakes every parked consumer up without a task."""
+        for consumers in self.parked.values():
+            for consumer in consumers:
+                consumer.set_result(None)
+        self.parked.clear()
+
+    def payload(self, task):
+        if isinstance(task.data, SpilledPayload):
+            return self.spill.read(task.data)
+        return task.data
+
+    def task_response(self, task):
+        if task is None:
+            return b"NONE"
+        return format_task(task.task_id, self.payload(task))
+
+    def task_frame(self, task):
+        if task is None:
+            return Status.NO, []
+        task_id = pack_string(bytes(task.task_id, "ascii"))
+        return Status.OK, [task_id, self.payload(task)]
+
+    def contains(self, queue, task_id):
+        return queue in self.task_queue_data and task_id in self.task_queue_data[queue]
+
+    def add_command(self, queue, length, task_data):
+        task = self.add(str(queue, "utf-8"), *split_schedule(task_data, int(length)))
+        return bytes(task.task_id, "ascii")
+
+    def madd_command(self, queue, count, tasks):
+        queue = str(queue, "utf-8")
+        task_ids = [
+            self.add(queue, task_data).task_id
+            for _, task_data in split_tasks(tasks, int(count))
+        ]
+        return bytes(" ".join(task_ids), "ascii")
+
+    def get_command(self, queue, wait=b"0"):
+        # Nothing can be added while a synchronous server waits, so the wait
+        # is only checked here, AsyncTaskQueueServer parks long polls.
+        parse_wait(wait)
+        return self.task_response(self.get(str(queue, "utf-8")))
+
+    def mget_command(self, queue, count):
+        queue = str(queue, "utf-8")
+        tasks = []
+        for _ in range(int(count)):
+            task = self.get(queue)
+            if task is None:
+                break
+            tasks.append(format_task(task.task_id, self.payload(task)))
+        if not tasks:
+            return b"NONE"
+        return b" ".join(tasks)
+
+    def ack_command(self, queue, task_id):
+        found = self.ack(str(queue, "utf-8"), str(task_id, "ascii"))
+        return b"YES" if found else b"NO"
+
+    def in_command(self, queue, task_id):
+        found = self.contains(str(queue, "utf-8"), str(task_id, "ascii"))
+        return b"YES" if found else b"NO"
+
+    def save_command(self):
+        self.save_data()
+        return b"OK"
+
+    def stats_command(self):
+        # Framed like a payload, the text spans many lines.
+        stats = self.stats()
+        return b"%d %s" % (len(stats), stats)
+
+    def stats(self):
+        """Returns the metrics and queue depths in the Prometheus text format."""
+        lines = self.metrics.render()
+        lines.append("# TYPE taskqueue_tasks gauge")
+        labels = self.metrics.labels
+        for name, queue in list(self.task_queue_data.items()):
+            running = queue.running
+            for state, count in (
+                (State.created, len(queue.tasks) - running),
+                (State.running, running),
+            ):
+                lines.append(
+                    format_sample(
+                        "taskqueue_tasks",
+                        count,
+                        {**labels, "queue": name, "state": state.value},
+                    )
+                )
+        lines += [
+            "# TYPE taskqueue_parked_consumers gauge",
+            format_sample(
+                "taskqueue_parked_consumers",
+                sum(len(consumers) for consumers in list(self.parked.values())),
+                labels,
+            ),
+        ]
+        return bytes("\n".join(lines) + "\n", "utf-8")
+
+    def log(self, op, queue, *fields):
+        queue = bytes(queue, "utf-8")
+        self.wal.append(op, queue, *fields)
+        if self.replication is not None:
+            self.replication.publish(op, queue, *fields)
+        if self.wal.records >= self.snapshot_every:
+            self.snapshot()
+
+    def apply_add(self, queue, task_data, priority=0, not_before=0.0):
+        if queue not in self.task_queue_data:
+            self.task_queue_data[queue] = Queue()
+        if self.spill.spills(task_data):
+            task_data = self.spill.write(task_data)
+        return self.task_queue_data[queue].add(task_data, priority, not_before)
+
+    def apply_ack(self, queue, task_id):
+        if queue not in self.task_queue_data:
+            return False
+        task = self.task_queue_data[queue].ack(task_id)
+        if task is None:
+            return False
+        if isinstance(task.data, SpilledPayload):
+            self.spill.release(task.data)
+        # The task may still sit in `ready` or `leases` until it is skipped.
+        task.data = b""
+        return True
+
+    def apply(self, op, queue, *fields):
+        queue = str(queue, "utf-8")
+        match op:
+            case Op.ADD:
+                self.apply_add(queue, *fields)
+            case Op.SCHEDULE:
+                options, task_data = fields
+                self.apply_add(queue, task_data, *SCHEDULE_OPTIONS.unpack(options))
+            case Op.GET:
+                self.task_queue_data[queue].lease(str(fields[0], "ascii"))
+            case Op.ACK:
+                self.apply_ack(queue, str(fields[0], "ascii"))
+            case Op.DEAD_LETTER:
+                self.apply_dead_letter(queue, str(fields[0], "ascii"))
+
+    def apply_dead_letter(self, queue, task_id):
+        """Moves a task out of `queue` to the end of its dead letter queue.
+
+        The payload is moved as is, a spilled one stays where it is.
+        """
+        task = self.task_queue_data[queue].ack(task_id)
+        dead_letters = queue + DEAD_LETTER_SUFFIX
+        if dead_letters not in self.task_queue_data:
+            self.task_queue_data[dead_letters] = Queue()
+        self.task_queue_data[dead_letters].add(task.data)
+        task.data = b""
+        return dead_letters
+
+    def dead_letter(self, queue, task):
+        dead_letters = self.apply_dead_letter(queue, task.task_id)
+        self.log(Op.DEAD_LETTER, queue, bytes(task.task_id, "ascii"))
+        self.metrics.dead_lettered += 1
+        if dead_letters in self.parked:
+            self.hand_out(dead_letters)
+
+    def exhausted(self, queue, task):
+        # Dead letter queues keep their tasks, there is nowhere further to go.
+        return (
+            self.max_deliveries > 0
+            and task.deliveries >= self.max_deliveries
+            and not queue.endswith(DEAD_LETTER_SUFFIX)
+        )
+
+    def expire(self, current_time):
+        while self.leases and self.leases[0][0] <= current_time:
+            deadline, queue, task = self.leases.popleft()
+            # ACKed tasks and tasks leased again since are skipped.
+            if task.state != State.running.value or task.deadline != deadline:
+                continue
+            self.metrics.expired += 1
+            if self.exhausted(queue, task):
+                self.dead_letter(queue, task)
+                continue
+            self.task_queue_data[queue].requeue(task)
+            if queue in self.parked:
+                self.hand_out(queue)
+
+    def release_delayed(self):
+        # Delayed tasks come due without any command, parked consumers are
+        # handed them here.
+        now = time.time()
+        for name in list(self.parked):
+            queue = self.task_queue_data.get(name)
+            if queue is not None and queue.has_due(now):
+                self.hand_out(name)
+
+    def tick(self):
+        self.expire(time.monotonic())
+        if self.parked:
+            self.release_delayed()
+        self.wal.tick()
+
+    def load_data(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.generation, self.task_queue_data = pickle.load(f)
+        for queue in self.task_queue_data.values():
+            for task in queue.tasks.values():
+                if isinstance(task.data, SpilledPayload):
+                    self.spill.count(task.data)
+        for op, fields in self.wal.replay(self.generation):
+            self.apply(op, *fields)
+        if self.wal.records:
+            # The snapshot on disk still refers to the payloads of tasks ACKed
+            # in the replayed log, a new one has to replace it before their
+            # segments are deleted.
+            self.snapshot()
+        else:
+            self.spill.reclaim()
+        self.restore_leases()
+
+    def restore_leases(self):
+        """Leases the running tasks anew, they were handed out elsewhere."""
+        deadline = time.monotonic() + self.timeout
+        for name, queue in self.task_queue_data.items():
+            for task in queue.rebuild():
+                task.deadline = deadline
+                self.leases.append((deadline, name, task))
+
+    def save_data(self):
+        self.wal.commit()
+
+    def replica_state(self):
+        """Returns the queues pickled for a standby, spilled payloads inline."""
+        state = io.BytesIO()
+        ReplicaPickler(state, self.spill).dump(self.task_queue_data)
+        return state.getvalue()
+
+    def load_replica_state(self, state):
+        """Replaces all queues with the state sent by the primary."""
+        for queue in self.task_queue_data.values():
+            for task in queue.tasks.values():
+                if isinstance(task.data, SpilledPayload):
+                    self.spill.release(task.data)
+        self.task_queue_data = pickle.loads(state)
+        for queue in self.task_queue_data.values():
+            for task in queue.tasks.values():
+                if self.spill.spills(task.data):
+                    task.data = self.spill.write(task.data)
+            # Leases are only handed out again on promotion.
+            queue.rebuild()
+        self.leases.clear()
+        self.snapshot()
+
+    def apply_replicated(self, record):
+        """Applies a WAL record streamed by the primary and logs it here."""
+        op, (queue, *fields) = decode_body(record)
+        self.apply(op, queue, *fields)
+        self.log(op, str(queue, "utf-8"), *fields)
+
+    def snapshot(self):
+        """Writes the whole state to disk and starts a new, empty WAL."""
+        started = time.monotonic_ns()
+        self.wal.commit()
+        self.spill.flush()
+        generation = self.generation + 1
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump((generation, self.task_queue_data), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.generation = generation
+        self.wal.reset(generation)
+        self.spill.reclaim()
+        self.metrics.snapshots.record(time.monotonic_ns() - started)
+
+    def close(self):
+        self.wal.close()
+        self.spill.close()
+
+
+class ReplicaPickler(pickle.Pickler):
+    def __init__(self, file, spill):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.spill = spill
+
+    def reducer_override(self, obj):
+        # A standby has segment files of its own, it gets the bytes.
+        if isinstance(obj, SpilledPayload):
+            return bytes, (bytes(self.spill.read(obj)),)
+        return NotImplemented
 
 
 class TaskQueueTCPHandler(socketserver.BaseRequestHandler):
@@ -38,111 +767,667 @@ class TaskQueueTCPHandler(socketserver.BaseRequestHandler):
                 break
         if len(received_data) == 0:
             return
-        received_data = received_data.decode("utf-8").split(" ")
-        command = received_data[0]
-
-        match command:
-            case "ADD":
-                self.add_command(*received_data[1:])
-            case "GET":
-                self.get_command(*received_data[1:])
-            case "ACK":
-                self.ack_command(*received_data[1:])
-            case "IN":
-                self.in_command(*received_data[1:])
-            case "SAVE":
-                self.save_command()
-            case _:
-                self.request.sendall(b"ERROR")
+        response = self.server.task_queue.execute(received_data)
+        self.request.sendall(response)
 
-    def add_command(self, queue, length, task_data):
-        if queue in server.task_queue_data:
-            server.task_queue_data[queue].max_id += 1
-        else:
-            server.task_queue_data[queue] = Queue()
 
-        task_id = str(server.task_queue_data[queue].max_id)
-        task = Task(task_id=task_id, data_length=length, data=task_data)
-        server.task_queue_data[queue].task_list.append(task)
-        response = bytes(str(task_id), "ascii")
-        self.request.sendall(response)
+class TaskQueueServer(socketserver.TCPServer):
+    def __init__(self, ip, port, path, timeout, metrics_port=None, **options):
+        self.ip = ip
+        self.port = port
+        self.task_queue = TaskQueue(path, timeout, **options)
+        self.exporter = metrics_port and start_exporter(
+            ip, metrics_port, self.task_queue.stats
+        )
 
-    def revert_state(self, queue):
-        current_time = time.time()
-        for i in server.task_queue_data[queue].task_list:
-            if (
-                current_time - i.taken_at >= server.timeout
-                and i.state == State.running.value
-            ):
-                i.state = State.created.value
-
-    def get_command(self, queue):
-        if queue in server.task_queue_data:
-            self.revert_state(queue)
-            for i in server.task_queue_data[queue].task_list:
-                if i.state == State.created.value:
-                    i.state = State.running.value
-                    i.taken_at = time.time()
-                    self.request.sendall(
-                        bytes(f"{i.task_id} {i.data_length} {i.data}", "ascii")
-                    )
-                    break
-        else:
-            self.request.sendall(b"NONE")
+        self.allow_reuse_address = True
+        super(TaskQueueServer, self).__init__((self.ip, self.port), TaskQueueTCPHandler)
 
-    def ack_command(self, queue, task_id):
-        found = False
-        if queue in server.task_queue_data:
-            for i in server.task_queue_data[queue].task_list:
-                if i.task_id == task_id and i.state != State.finished.value:
-                    i.state = State.finished.value
-                    found = True
-                    break
-        if found is False:
-            self.request.sendall(b"NO")
-        else:
-            self.request.sendall(b"YES")
+    def serve_forever(self, poll_interval=None):
+        super().serve_forever(poll_interval or self.task_queue.tick_interval)
 
-    def in_command(self, queue, task_id):
-        found = False
-        if queue in server.task_queue_data:
-            for i in server.task_queue_data[queue].task_list:
-                if i.state != State.finished.value and i.task_id == task_id:
-                    found = True
-                    break
-        if found is False:
-            self.request.sendall(b"NO")
-        else:
-            self.request.sendall(b"YES")
+    def service_actions(self):
+        self.task_queue.tick()
 
-    def save_command(self):
-        server.save_data()
-        self.request.sendall(b"OK")
+    def server_close(self):
+        super().server_close()
+        if self.exporter:
+            self.exporter.shutdown()
+        self.task_queue.close()
 
 
-class TaskQueueServer(socketserver.TCPServer):
-    def __init__(self, ip, port, path, timeout):
+def missing_bytes(message):
+    """Returns how many more bytes a length framed ADD or MADD needs at least.
+
+    Returns None if the payload is malformed and can not be completed.
+    """
+    parts = message.split(b" ", 3)
+    if len(parts) < 4 or not parts[2].isdigit():
+        return 0
+    match parts[0]:
+        case b"ADD":
+            return max(int(parts[2]) - len(parts[3]), 0)
+        case b"MADD":
+            try:
+                split_tasks(parts[3], int(parts[2]))
+            except IncompleteMessage as e:
+                return e.missing
+            except ValueError:
+                return None
+    return 0
+
+
+async def read_line(reader):
+    """Like `reader.readline()`, but for lines longer than the stream limit."""
+    chunks = []
+    while True:
+        try:
+            chunks.append(await reader.readuntil(b"\n"))
+            break
+        except asyncio.LimitOverrunError as e:
+            chunks.append(await reader.readexactly(e.consumed))
+        except asyncio.IncompleteReadError as e:
+            chunks.append(e.partial)
+            break
+    return b"".join(chunks)
+
+
+async def read_message(reader, prefix=b""):
+    """Reads one newline terminated command from a persistent connection.
+
+    ADD and MADD payloads are framed by their length, so they may contain
+    newlines. Returns None once the client has closed the connection.
+    """
+    line = prefix + await read_line(reader)
+    if not line:
+        return None
+    message = line.removesuffix(b"\n")
+    if missing_bytes(message) and missing_bytes(line) is not None:
+        # The newline belongs to the payload, read on until it is complete.
+        message = line
+        while missing := missing_bytes(message):
+            message += await reader.readexactly(missing)
+        # The rest of the line holds the options after the payload.
+        message += (await read_line(reader)).removesuffix(b"\n")
+    return message
+
+
+REPLICATION_MAGIC = b"\x00TQR"
+# Length of the body and the sequence number of the last change in it.
+REPLICATION_HEADER = struct.Struct("!IQ")
+# Commands a standby answers before it is promoted.
+STANDBY_COMMANDS = {b"IN", b"STATS"}
+STANDBY_OPCODES = {Opcode.IN, Opcode.STATS}
+
+
+async def read_replication_frame(reader):
+    """Returns the sequence number and the body of the next frame."""
+    length, sequence = REPLICATION_HEADER.unpack(
+        await reader.readexactly(REPLICATION_HEADER.size)
+    )
+    return sequence, await reader.readexactly(length)
+
+
+class Replication:
+    """Streams the changes of a TaskQueue to standby servers.
+
+    A standby connects with REPLICATION_MAGIC and gets the whole state in
+    the first frame, then every WAL record as it is logged. Changes are
+    numbered, the standby sends back empty frames with the number of the
+    last change it has applied. A standby that falls `buffer_limit` bytes
+    behind is disconnected, it reconnects and starts over from the state.
+    """
+
+    def __init__(self, buffer_limit=64 * 1024 * 1024):
+        self.buffer_limit = buffer_limit
+        self.sequence = 0
+        self.confirmed = 0
+        self.replicas = set()
+        # (sequence, future) of writes waiting for a standby, in order.
+        self.waiters = deque()
+
+    def publish(self, op, *fields):
+        self.sequence += 1
+        if not self.replicas:
+            return
+        chunks = encode_body(op, fields)
+        header = REPLICATION_HEADER.pack(sum(map(len, chunks)), self.sequence)
+        for writer in list(self.replicas):
+            if writer.transport.get_write_buffer_size() > self.buffer_limit:
+                writer.close()
+                self.detach(writer)
+            else:
+                writer.writelines([header, *chunks])
+
+    def attach(self, writer, state):
+        writer.writelines([REPLICATION_HEADER.pack(len(state), self.sequence), state])
+        self.replicas.add(writer)
+
+    def detach(self, writer):
+        self.replicas.discard(writer)
+        if not self.replicas:
+            # Nobody left to wait for.
+            self.confirm(self.sequence)
+
+    def confirm(self, sequence):
+        self.confirmed = max(self.confirmed, sequence)
+        while self.waiters and self.waiters[0][0] <= self.confirmed:
+            waiter = self.waiters.popleft()[1]
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait(self, sequence):
+        """Waits until a standby has applied the change `sequence`."""
+        if sequence <= self.confirmed or not self.replicas:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((sequence, waiter))
+        await waiter
+
+
+class AsyncTaskQueueServer:
+    """Serves a TaskQueue from an asyncio event loop.
+
+    Any server streams its changes to the standbys that connect to it. With
+    `primary` it is itself a standby of the server at that (ip, port): it
+    applies the changes streamed from there and only answers IN, STATS and
+    PROMOTE until PROMOTE makes it a primary. With `synchronous` the changes
+    a command makes are only answered once a standby, if there is one
+    connected, has applied them.
+    """
+
+    def __init__(
+        self,
+        ip,
+        port,
+        path,
+        timeout,
+        backlog=4096,
+        metrics_port=None,
+        primary=None,
+        synchronous=False,
+        **options,
+    ):
         self.ip = ip
         self.port = port
-        self.path = path + "data.pkl"
-        self.timeout = timeout
+        self.backlog = backlog
+        self.task_queue = TaskQueue(path, timeout, **options)
+        self.exporter = metrics_port and start_exporter(
+            ip, metrics_port, self.task_queue.stats
+        )
+        self.connections = dict()
+        self.replication = self.task_queue.replication = Replication()
+        self.synchronous = synchronous
+        self.primary = primary
+        self.following = None
+        self.applied = 0
+        self.reporting = False
+        if primary is not None:
+            # Whatever was leased here is superseded by the primary's state.
+            self.task_queue.leases.clear()
 
-        self.task_queue_data = dict()
-        self.processes = list()
+    async def execute(self, message):
+        command, *arguments = message.split(b" ", 3)
+        if command == b"PROMOTE" and not arguments:
+            return self.promote()
+        if self.primary is not None and command not in STANDBY_COMMANDS:
+            return b"ERROR"
+        sequence = self.replication.sequence
+        response = await self.run(command, arguments, message)
+        if self.synchronous and self.replication.sequence != sequence:
+            await self.replication.wait(self.replication.sequence)
+        return response
 
-        self.load_data()
+    async def run(self, command, arguments, message):
+        if command == b"GET" and len(arguments) == 2:
+            try:
+                wait = parse_wait(arguments[1])
+            except ValueError:
+                return b"ERROR"
+            task = await self.get_blocking(str(arguments[0], "utf-8"), wait)
+            return self.task_queue.task_response(task)
+        return self.task_queue.execute(message)
 
-        self.allow_reuse_address = True
-        super(TaskQueueServer, self).__init__((self.ip, self.port), TaskQueueTCPHandler)
+    async def execute_binary(self, opcode, body):
+        if opcode == Opcode.PROMOTE:
+            self.promote()
+            return Status.OK, []
+        if self.primary is not None and opcode not in STANDBY_OPCODES:
+            return Status.ERROR, []
+        sequence = self.replication.sequence
+        response = await self.run_binary(opcode, body)
+        if self.synchronous and self.replication.sequence != sequence:
+            await self.replication.wait(self.replication.sequence)
+        return response
 
-    def load_data(self):
-        if os.path.exists(self.path):
-            with open(self.path, "r") as f:
-                self.task_queue_data = pickle.load(f)
+    async def run_binary(self, opcode, body):
+        if opcode == Opcode.GET:
+            try:
+                queue, offset = unpack_string(body, 0)
+                queue = str(queue, "utf-8")
+            except (struct.error, ValueError):
+                return Status.ERROR, []
+            if offset + WAIT.size == len(body):
+                (wait,) = WAIT.unpack_from(body, offset)
+                task = await self.get_blocking(queue, wait / 1000)
+                return self.task_queue.task_frame(task)
+        return self.task_queue.execute_binary(opcode, body)
 
-    def save_data(self):
-        with open(self.path, "w") as f:
-            pickle.dump(self.task_queue_data, f)
+    async def get_blocking(self, queue, wait):
+        """Returns the next task of `queue`, waiting up to `wait` seconds.
+
+        Consumers that find the queue empty are parked and get tasks in the
+        order they came, as soon as a task is added or a lease expires.
+        """
+        started = time.perf_counter_ns()
+        task = self.task_queue.get(queue)
+        if task is None and wait > 0:
+            consumer = asyncio.get_running_loop().create_future()
+            self.task_queue.park(queue, consumer)
+            try:
+                await asyncio.wait([consumer], timeout=wait)
+            finally:
+                if not consumer.done():
+                    self.task_queue.unpark(queue, consumer)
+            task = consumer.result() if consumer.done() else None
+        # Timed apart from GET, the wait is not the server's latency.
+        self.task_queue.metrics.record("GET_WAIT", time.perf_counter_ns() - started)
+        return task
+
+    async def handle_connection(self, reader, writer):
+        # Commands from one connection are answered in the order they were
+        # sent, so clients may pipeline without waiting for each response.
+        self.connections[asyncio.current_task()] = writer
+        try:
+            first = await reader.readexactly(1)
+            if first != MAGIC[:1]:
+                await self.serve_text(reader, writer, first)
+                return
+            magic = first + await reader.readexactly(len(MAGIC) - 1)
+            if magic == MAGIC:
+                await self.serve_binary(reader, writer)
+            elif magic == REPLICATION_MAGIC:
+                await self.serve_replica(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def serve_text(self, reader, writer, prefix):
+        while (message := await read_message(reader, prefix)) is not None:
+            prefix = b""
+            writer.write(await self.execute(message) + b"\n")
+            await writer.drain()
+
+    async def serve_binary(self, reader, writer):
+        writer.write(MAGIC)
+        while True:
+            opcode, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            body = memoryview(await reader.readexactly(length))
+            status, chunks = await self.execute_binary(opcode, body)
+            writer.writelines(frame(status, chunks))
+            await writer.drain()
+
+    async def serve_replica(self, reader, writer):
+        self.replication.attach(writer, self.task_queue.replica_state())
+        try:
+            while True:
+                sequence, _ = await read_replication_frame(reader)
+                self.replication.confirm(sequence)
+        finally:
+            self.replication.detach(writer)
+
+    async def follow(self):
+        """Applies the changes streamed by the primary until promoted.
+
+        The connection is retried with exponential backoff, and every time
+        it is made the standby starts over from the whole state.
+        """
+        delay = 0.1
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.primary)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            delay = 0.1
+            try:
+                writer.write(REPLICATION_MAGIC)
+                _, state = await read_replication_frame(reader)
+                self.task_queue.load_replica_state(state)
+                while True:
+                    self.applied, record = await read_replication_frame(reader)
+                    self.task_queue.apply_replicated(record)
+                    # Records that arrived together are confirmed at once.
+                    if not self.reporting:
+                        self.reporting = True
+                        asyncio.get_running_loop().call_soon(self.report, writer)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+    def report(self, writer):
+        self.reporting = False
+        if not writer.is_closing():
+            writer.write(REPLICATION_HEADER.pack(0, self.applied))
+
+    def promote(self):
+        """Stops following the primary and starts serving as one."""
+        if self.primary is not None:
+            self.following.cancel()
+            self.primary = None
+            self.task_queue.restore_leases()
+        return b"OK"
+
+    async def close_connections(self):
+        self.task_queue.release_parked()
+        for writer in self.connections.values():
+            writer.close()
+        if self.connections:
+            await asyncio.wait(self.connections)
+
+    async def tick_forever(self):
+        while True:
+            await asyncio.sleep(self.task_queue.tick_interval)
+            self.task_queue.tick()
+
+    async def start_servers(self):
+        server = await asyncio.start_server(
+            self.handle_connection,
+            self.ip,
+            self.port,
+            backlog=self.backlog,
+            reuse_address=True,
+        )
+        return [server]
+
+    async def serve(self):
+        ticker = asyncio.create_task(self.tick_forever())
+        if self.primary is not None:
+            self.following = asyncio.create_task(self.follow())
+        servers = await self.start_servers()
+        stopped = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, stopped.set_result, None
+        )
+        try:
+            await stopped
+            for server in servers:
+                server.close()
+            await self.close_connections()
+        finally:
+            ticker.cancel()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def server_close(self):
+        if self.exporter:
+            self.exporter.shutdown()
+        self.task_queue.close()
+
+
+PEER_HEADER = struct.Struct("!II")
+
+
+def shard_socket(path, shard):
+    """Returns the path of the socket shard `shard` listens on for the others."""
+    return os.path.join(path, f"shard-{shard}.sock")
+
+
+async def read_peer_frame(reader):
+    """Returns the request id and the message of the next peer frame."""
+    length, request_id = PEER_HEADER.unpack(await reader.readexactly(PEER_HEADER.size))
+    return request_id, await reader.readexactly(length)
+
+
+def peer_frame(request_id, message):
+    return PEER_HEADER.pack(len(message), request_id) + message
+
+
+def write_frames(writer, frames):
+    """Writes the frames collected so far with a single system call."""
+    writer.writelines(frames)
+    frames.clear()
+
+
+class ShardLink:
+    """Pipelined Unix socket connection to another shard.
+
+    Long-polling GETs may be answered after requests sent later, so answers
+    are matched to requests by id. Requests made in one iteration of the
+    event loop are written together.
+    """
+
+    def __init__(self, path, connect_attempts=50):
+        self.path = path
+        self.connect_attempts = connect_attempts
+        self.writer = None
+        self.waiters = dict()
+        self.unsent = []
+        self.next_id = 0
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        # Shards start at the same time, give the peer a moment to listen.
+        for attempt in range(self.connect_attempts):
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except OSError:
+                if attempt == self.connect_attempts - 1:
+                    raise
+                await asyncio.sleep(0.1)
+        asyncio.create_task(self.read_responses(reader, self.writer))
+
+    async def read_responses(self, reader, writer):
+        try:
+            while True:
+                request_id, response = await read_peer_frame(reader)
+                waiter = self.waiters.pop(request_id)
+                # The client may have gone away in the meantime.
+                if not waiter.done():
+                    waiter.set_result(response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        if self.writer is writer:
+            self.writer = None
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("Shard is gone"))
+        self.waiters.clear()
+
+    async def request(self, message):
+        async with self.lock:
+            if self.writer is None:
+                await self.connect()
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) % 2**32
+        response = asyncio.get_running_loop().create_future()
+        self.waiters[request_id] = response
+        if not self.unsent:
+            asyncio.get_running_loop().call_soon(write_frames, self.writer, self.unsent)
+        self.unsent.append(peer_frame(request_id, message))
+        await self.writer.drain()
+        return await response
+
+
+class ShardWorker(AsyncTaskQueueServer):
+    """One shard of a ShardedTaskQueueServer.
+
+    Every worker accepts clients on the shared port (SO_REUSEPORT) and
+    forwards commands for queues owned by another shard to it. Shard `i`
+    also accepts clients on `port + 1 + i`, so a client that sends the
+    commands of a queue to its shard saves the forwarding hop. It listens
+    for other shards on the Unix socket `shard-i.sock` in the data
+    directory, which skips the TCP stack of a loopback hop. Each peer frame
+    is a text command tagged with b"T" or a binary request tagged with
+    b"B". Peer requests run concurrently, so a parked GET holds up nothing
+    else, and their answers are written together like the requests.
+    """
+
+    def __init__(
+        self, ip, port, path, timeout, shard, shards, metrics_port=None, **options
+    ):
+        shard_path = os.path.join(path, f"shard-{shard}")
+        os.makedirs(shard_path, exist_ok=True)
+        if metrics_port:
+            metrics_port += shard
+        super().__init__(
+            ip, port, shard_path, timeout, metrics_port=metrics_port, **options
+        )
+        self.task_queue.metrics.labels["shard"] = str(shard)
+        self.shard = shard
+        self.shards = shards
+        self.peer_path = shard_socket(path, shard)
+        self.links = {
+            other: ShardLink(shard_socket(path, other))
+            for other in range(shards)
+            if other != shard
+        }
+        self.peer_requests = set()
+
+    async def save_all(self):
+        responses = await asyncio.gather(
+            *(link.request(b"TSAVE") for link in self.links.values())
+        )
+        responses.append(self.task_queue.execute(b"SAVE"))
+        return all(response == b"OK" for response in responses)
+
+    async def stats_all(self):
+        responses = await asyncio.gather(
+            *(link.request(b"B%c" % Opcode.STATS) for link in self.links.values())
+        )
+        return self.task_queue.stats() + b"".join(
+            response[1:] for response in responses
+        )
+
+    async def execute(self, message):
+        command, *arguments = message.split(b" ", 2)
+        if message == b"SAVE":
+            return b"OK" if await self.save_all() else b"ERROR"
+        if message == b"STATS":
+            stats = await self.stats_all()
+            return b"%d %s" % (len(stats), stats)
+        if arguments:
+            owner = shard_of(arguments[0], self.shards)
+            if owner != self.shard:
+                return await self.links[owner].request(b"T" + message)
+        return await super().execute(message)
+
+    async def execute_binary(self, opcode, body):
+        if opcode == Opcode.SAVE:
+            return (Status.OK if await self.save_all() else Status.ERROR), []
+        if opcode == Opcode.STATS:
+            return Status.OK, [await self.stats_all()]
+        try:
+            queue, _ = unpack_string(body, 0)
+        except (struct.error, ValueError):
+            return Status.ERROR, []
+        owner = shard_of(bytes(queue), self.shards)
+        if owner != self.shard:
+            response = await self.links[owner].request(b"B%c%s" % (opcode, body))
+            return response[0], [response[1:]]
+        return await super().execute_binary(opcode, body)
+
+    async def execute_peer(self, message):
+        if message[:1] == b"B":
+            status, chunks = await super().execute_binary(
+                message[1], memoryview(message)[2:]
+            )
+            return bytes([status]) + b"".join(chunks)
+        return await super().execute(message[1:])
+
+    async def answer_peer(self, writer, answers, request_id, message):
+        response = await self.execute_peer(message)
+        if writer.is_closing():
+            return
+        if not answers:
+            asyncio.get_running_loop().call_soon(write_frames, writer, answers)
+        answers.append(peer_frame(request_id, response))
+
+    async def handle_peer(self, reader, writer):
+        self.connections[asyncio.current_task()] = writer
+        answers = []
+        try:
+            while True:
+                request_id, message = await read_peer_frame(reader)
+                request = asyncio.create_task(
+                    self.answer_peer(writer, answers, request_id, message)
+                )
+                self.peer_requests.add(request)
+                request.add_done_callback(self.peer_requests.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def start_servers(self):
+        server = await asyncio.start_server(
+            self.handle_connection,
+            self.ip,
+            self.port,
+            backlog=self.backlog,
+            reuse_port=True,
+        )
+        # Clients that route queues to their shards themselves come here.
+        own_server = await asyncio.start_server(
+            self.handle_connection,
+            self.ip,
+            self.port + 1 + self.shard,
+            backlog=self.backlog,
+            reuse_address=True,
+        )
+        peer_server = await asyncio.start_unix_server(
+            self.handle_peer, self.peer_path, backlog=self.backlog
+        )
+        return [server, own_server, peer_server]
+
+
+def run_shard(*args, **options):
+    worker = ShardWorker(*args, **options)
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.server_close()
+
+
+class ShardedTaskQueueServer:
+    """Runs one ShardWorker process per core, each owning a hash partition
+    of queue names."""
+
+    def __init__(self, ip, port, path, timeout, workers, **options):
+        self.processes = [
+            multiprocessing.Process(
+                target=run_shard,
+                args=(ip, port, path, timeout, shard, workers),
+                kwargs=options,
+            )
+            for shard in range(workers)
+        ]
+
+    def serve_forever(self):
+        for process in self.processes:
+            process.start()
+        for process in self.processes:
+            process.join()
+
+    def server_close(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def parse_address(address):
+    ip, _, port = address.rpartition(":")
+    return ip or "127.0.0.1", int(port)
 
 
 def parse_args():
@@ -176,10 +1461,120 @@ def parse_args():
         default=300,
         help="Task maximum GET timeout in seconds",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-a",
+        action="store_true",
+        dest="asyncio",
+        default=False,
+        help="Serve persistent pipelined connections from an asyncio event loop",
+    )
+    parser.add_argument(
+        "-b",
+        action="store",
+        dest="fsync_batch",
+        type=int,
+        default=128,
+        help="Fsync the write-ahead log after this many changes",
+    )
+    parser.add_argument(
+        "-f",
+        action="store",
+        dest="fsync_interval",
+        type=float,
+        default=0.01,
+        help="Fsync pending write-ahead log changes at least this often, in seconds",
+    )
+    parser.add_argument(
+        "-s",
+        action="store",
+        dest="snapshot_every",
+        type=int,
+        default=100_000,
+        help="Compact the write-ahead log into a snapshot after this many changes",
+    )
+    parser.add_argument(
+        "-w",
+        action="store",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Shard queues over this many asyncio worker processes",
+    )
+    parser.add_argument(
+        "-m",
+        action="store",
+        dest="spill_threshold",
+        type=int,
+        default=64 * 1024,
+        help="Keep payloads of at least this many bytes in mmap'd files, 0 disables",
+    )
+    parser.add_argument(
+        "-d",
+        action="store",
+        dest="max_deliveries",
+        type=int,
+        default=0,
+        help="Move tasks leased this many times to <queue>.dlq, 0 disables",
+    )
+    parser.add_argument(
+        "-e",
+        action="store",
+        dest="metrics_port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics over HTTP on this port, shard i on port + i",
+    )
+    parser.add_argument(
+        "-r",
+        action="store",
+        dest="primary",
+        type=parse_address,
+        default=None,
+        help="Run as a standby of the server at ip:port until PROMOTE, implies -a",
+    )
+    parser.add_argument(
+        "-y",
+        action="store_true",
+        dest="synchronous",
+        default=False,
+        help="Answer changes once a connected standby has applied them, implies -a",
+    )
+    args = parser.parse_args()
+    if args.workers > 1 and (args.primary or args.synchronous):
+        parser.error("replication is not supported with -w")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    server = TaskQueueServer(**args.__dict__)
-    server.serve_forever()
+    options = dict(
+        fsync_batch=args.fsync_batch,
+        fsync_interval=args.fsync_interval,
+        snapshot_every=args.snapshot_every,
+        spill_threshold=args.spill_threshold,
+        max_deliveries=args.max_deliveries,
+        metrics_port=args.metrics_port,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.workers > 1:
+        server = ShardedTaskQueueServer(
+            args.ip, args.port, args.path, args.timeout, args.workers, **options
+        )
+    elif args.asyncio or args.primary or args.synchronous:
+        server = AsyncTaskQueueServer(
+            args.ip,
+            args.port,
+            args.path,
+            args.timeout,
+            primary=args.primary,
+            synchronous=args.synchronous,
+            **options,
+        )
+    else:
+        server = TaskQueueServer(args.ip, args.port, args.path, args.timeout, **options)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
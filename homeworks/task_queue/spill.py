@@ -0,0 +1,110 @@
+import glob
+import mmap
+import os
+from typing import NamedTuple
+
+
+class SpilledPayload(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+
+
+class Segment:
+    def __init__(self, path, number, size=0):
+        self.path = path
+        self.number = number
+        with open(path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), 0)
+        self.used = 0
+        self.live = 0
+
+    def close(self):
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A view of a payload is still being sent, try again later.
+            return False
+        os.remove(self.path)
+        return True
+
+
+class SpillStore:
+    """Keeps large task payloads in mmap'd segment files instead of memory.
+
+    Payloads are appended to the active segment and read back as views of
+    the mapping, so the kernel pages them in and out as needed. Segments
+    whose payloads are all gone are deleted on `reclaim`.
+    """
+
+    def __init__(self, path, threshold, segment_size=64 * 1024 * 1024):
+        self.path = path
+        self.threshold = threshold
+        self.segment_size = segment_size
+
+        self.segments = dict()
+        for name in glob.glob(os.path.join(path, "payloads-*.seg")):
+            number = int(os.path.basename(name)[len("payloads-") : -len(".seg")])
+            self.segments[number] = Segment(name, number)
+        self.active = None
+
+    def spills(self, data):
+        return self.threshold and len(data) >= self.threshold
+
+    def _segment_for(self, length):
+        active = self.active
+        if active is not None and active.used + length <= len(active.mmap):
+            return active
+        number = max(self.segments, default=-1) + 1
+        self.active = Segment(
+            os.path.join(self.path, f"payloads-{number}.seg"),
+            number,
+            max(self.segment_size, length),
+        )
+        self.segments[number] = self.active
+        return self.active
+
+    def write(self, data):
+        segment = self._segment_for(len(data))
+        offset = segment.used
+        segment.mmap[offset : offset + len(data)] = data
+        segment.used += len(data)
+        segment.live += 1
+        return SpilledPayload(segment.number, offset, len(data))
+
+    def read(self, payload):
+        segment = self.segments[payload.segment]
+        return memoryview(segment.mmap)[
+            payload.offset : payload.offset + payload.length
+        ]
+
+    def release(self, payload):
+        self.segments[payload.segment].live -= 1
+
+    def count(self, payload):
+        """Counts a payload that was loaded from a snapshot as live."""
+        self.segments[payload.segment].live += 1
+
+    def flush(self):
+        for segment in self.segments.values():
+            segment.mmap.flush()
+
+    def reclaim(self):
+        """Deletes every segment without live payloads but the active one.
+
+        Only called right after a snapshot, so no snapshot on disk still
+        refers to a deleted segment.
+        """
+        for number, segment in list(self.segments.items()):
+            if segment is not self.active and segment.live == 0:
+                if segment.close():
+                    del self.segments[number]
+
+    def close(self):
+        for segment in self.segments.values():
+            try:
+                segment.mmap.close()
+            except BufferError:
+                pass
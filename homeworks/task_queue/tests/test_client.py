@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from client import AsyncClient, Client, Task
+from tests.test_server import ServerTestCase
+
+
+def madd_count(stats):
+    prefix = 'taskqueue_command_seconds_count{command="MADD"} '
+    for line in stats.splitlines():
+        if line.startswith(prefix):
+            return int(line[len(prefix) :])
+    return 0
+
+
+class ClientTest(ServerTestCase):
+    server_args = ["-a"]
+    client_options = {}
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client(pool_size=2, **self.client_options)
+        self.addCleanup(self.client.close)
+
+    def test_base_scenario(self):
+        task_id = self.client.add("1", b"12345")
+        self.assertTrue(self.client.contains("1", task_id))
+        self.assertEqual(Task(task_id, b"12345"), self.client.get("1"))
+        self.assertTrue(self.client.ack("1", task_id))
+        self.assertFalse(self.client.contains("1", task_id))
+        self.assertFalse(self.client.ack("1", task_id))
+        self.assertIsNone(self.client.get("1"))
+
+    def test_many(self):
+        task_ids = self.client.add_many("1", [b"a", b"b\nc", b""])
+        self.assertEqual(3, len(set(task_ids)))
+        tasks = self.client.get_many("1", 5)
+        self.assertEqual(list(zip(task_ids, [b"a", b"b\nc", b""])), tasks)
+        self.assertEqual([], self.client.get_many("1", 5))
+
+    def test_priority(self):
+        low = self.client.add("1", b"low")
+        high = self.client.add("1", b"high", priority=5)
+        later = self.client.add("1", b"later", not_before=time.time() + 60)
+        self.assertEqual(high, self.client.get("1").task_id)
+        self.assertEqual(low, self.client.get("1").task_id)
+        self.assertIsNone(self.client.get("1"))
+        self.assertTrue(self.client.contains("1", later))
+
+    def test_batching(self):
+        futures = [self.client.add_nowait("1", b"%d" % i) for i in range(1000)]
+        task_ids = [future.result() for future in futures]
+        self.assertEqual(1000, len(set(task_ids)))
+        # All of them went out in a handful of MADDs, in the order added.
+        self.assertLessEqual(madd_count(self.client.stats()), 10)
+        tasks = self.client.get_many("1", 1000)
+        self.assertEqual([b"%d" % i for i in range(1000)], [t.data for t in tasks])
+        self.assertEqual(task_ids, [t.task_id for t in tasks])
+
+    def test_threads(self):
+        task_ids = []
+
+        def add():
+            for i in range(100):
+                task_ids.append(self.client.add("1", b"x"))
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(400, len(set(task_ids)))
+        self.assertEqual(400, len(self.client.get_many("1", 1000)))
+
+    def test_get_wait(self):
+        started = time.monotonic()
+        self.assertIsNone(self.client.get("1", wait=0.3))
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+        waiting = self.client.submit(self.client.client.get("1", wait=5))
+        time.sleep(0.2)
+        # The parked GET does not hold up the pooled connections.
+        task_id = self.client.add("1", b"wake")
+        self.assertEqual(Task(task_id, b"wake"), waiting.result(timeout=5))
+
+    def test_reconnect(self):
+        self.client.add("1", b"x")
+        self.restart_server()
+        self.assertTrue(self.client.add("1", b"y"))
+        self.client.close()
+
+        self.stop_server()
+        threading.Timer(0.3, self.start_server).start()
+        # The server is down for a while, connecting backs off until it is up.
+        with Client(pool_size=1, backoff=0.05) as client:
+            self.assertTrue(client.add("1", b"z"))
+
+    def test_unreachable(self):
+        with Client(port=5599, connect_attempts=3, backoff=0.01) as client:
+            with self.assertRaises(ConnectionError):
+                client.add("1", b"x")
+
+
+class AsyncClientTest(ServerTestCase):
+    server_args = ["-a"]
+
+    def test_gather(self):
+        async def scenario():
+            async with AsyncClient(pool_size=2) as client:
+                task_ids = await asyncio.gather(
+                    *(client.add(str(i % 3), b"%d" % i) for i in range(300))
+                )
+                tasks = await asyncio.gather(
+                    *(client.get(str(i % 3)) for i in range(300))
+                )
+                acked = await asyncio.gather(
+                    *(client.ack(str(i % 3), t.task_id) for i, t in enumerate(tasks))
+                )
+                return task_ids, tasks, acked, await client.stats()
+
+        task_ids, tasks, acked, stats = asyncio.run(scenario())
+        self.assertEqual(task_ids, [task.task_id for task in tasks])
+        self.assertEqual([b"%d" % i for i in range(300)], [t.data for t in tasks])
+        self.assertTrue(all(acked))
+        self.assertEqual(3, madd_count(stats))
+
+    def test_add_then_get(self):
+        async def scenario():
+            async with AsyncClient() as client:
+                return await asyncio.gather(
+                    client.add("1", b"x"),
+                    client.get("1"),
+                    client.add("1", b"y"),
+                    client.get_many("1", 2),
+                )
+
+        first, task, second, tasks = asyncio.run(scenario())
+        self.assertEqual(Task(first, b"x"), task)
+        self.assertEqual([Task(second, b"y")], tasks)
+
+
+class ShardedClientTest(ClientTest):
+    server_args = ["-w", "2"]
+
+    def setUp(self):
+        super().setUp()
+        time.sleep(0.5)
+
+
+class RoutedClientTest(ShardedClientTest):
+    client_options = {"shards": 2}
+
+
+if __name__ == "__main__":
+    unittest.main()
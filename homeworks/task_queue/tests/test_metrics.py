@@ -0,0 +1,43 @@
+import unittest
+from unittest import TestCase
+
+from metrics import SUB_BUCKETS, Histogram, format_histogram, format_labels
+
+
+class HistogramTest(TestCase):
+    def test_percentile(self):
+        histogram = Histogram()
+        for microseconds in range(1, 10_001):
+            histogram.record(microseconds * 1000)
+        for fraction in (0.5, 0.99, 0.999):
+            expected = fraction * 10_000 / 1e6
+            self.assertGreaterEqual(histogram.percentile(fraction), expected)
+            self.assertLessEqual(
+                histogram.percentile(fraction), expected * (1 + 2 / SUB_BUCKETS)
+            )
+
+    def test_small_values_are_exact(self):
+        histogram = Histogram()
+        histogram.record(3_000)
+        self.assertEqual(4e-6, histogram.percentile(1.0))
+
+    def test_huge_values(self):
+        histogram = Histogram()
+        histogram.record(10**15)
+        self.assertGreaterEqual(histogram.percentile(1.0), 1e6)
+
+    def test_format(self):
+        histogram = Histogram()
+        histogram.record(20_000)
+        histogram.record(2_000_000)
+        lines = format_histogram("t", histogram, {"queue": 'a"b'})
+        self.assertEqual('t_bucket{queue="a\\"b",le="+Inf"} 2', lines[-3])
+        self.assertEqual('t_count{queue="a\\"b"} 2', lines[-1])
+        cumulative = [int(line.rsplit(" ", 1)[1]) for line in lines[:-3]]
+        self.assertEqual(sorted(cumulative), cumulative)
+        self.assertEqual([1, 2], sorted(set(cumulative) - {0}))
+        self.assertEqual("", format_labels({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,53 @@
+import os
 import socket
 import subprocess
+import sys
+import tempfile
 import time
 import unittest
+import urllib.request
 from unittest import TestCase
 
+from binary_protocol import (
+    HEADER,
+    MAGIC,
+    Opcode,
+    SCHEDULE,
+    WAIT,
+    Status,
+    pack_payload,
+    pack_string,
+)
+
+
+SERVER_PATH = os.path.join(os.path.dirname(__file__), "..", "server.py")
+
+
+class ServerTestCase(TestCase):
+    server_args = []
 
-class ServerBaseTest(TestCase):
     def setUp(self):
-        self.server = subprocess.Popen(["python3", "../server.py"])
-        time.sleep(0.5)
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.start_server()
 
     def tearDown(self):
+        self.stop_server()
+        self.data_dir.cleanup()
+
+    def start_server(self):
+        self.server = subprocess.Popen(
+            [sys.executable, SERVER_PATH, "-c", self.data_dir.name, *self.server_args]
+        )
+        time.sleep(0.5)
+
+    def stop_server(self):
         self.server.terminate()
         self.server.wait()
 
+    def restart_server(self):
+        self.stop_server()
+        self.start_server()
+
     def send(self, command):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -23,6 +57,8 @@ class ServerBaseTest(TestCase):
         s.close()
         return data
 
+
+class ServerBaseTest(ServerTestCase):
     def test_base_scenario(self):
         task_id = self.send(b"ADD 1 5 12345")
         self.assertEqual(b"YES", self.send(b"IN 1 " + task_id))
@@ -58,6 +94,546 @@ class ServerBaseTest(TestCase):
     def test_wrong_command(self):
         self.assertEqual(b"ERROR", self.send(b"ADDD 1 5 12345"))
 
+    def test_get_empty(self):
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+        task_id = self.send(b"ADD 1 5 12345")
+        self.assertEqual(task_id + b" 5 12345", self.send(b"GET 1"))
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+
+    def test_ack_not_taken(self):
+        task_id = self.send(b"ADD 1 5 12345")
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_id))
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+
+    def test_priority(self):
+        for options in (b"a", b"b 5", b"c 5", b"d -1"):
+            self.send(b"ADD 1 1 " + options)
+        self.assertEqual(
+            [b"1 1 b", b"2 1 c", b"0 1 a", b"3 1 d", b"NONE"],
+            [self.send(b"GET 1") for _ in range(5)],
+        )
+        self.assertEqual(b"ERROR", self.send(b"ADD 1 1 ab"))
+        self.assertEqual(b"ERROR", self.send(b"ADD 1 1 a x"))
+        self.assertEqual(b"ERROR", self.send(b"ADD 1 1 a 1 2 3"))
+
+    def test_not_before(self):
+        not_before = b"%f" % (time.time() + 0.5)
+        task_id = self.send(b"ADD 1 1 a 0 " + not_before)
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"IN 1 " + task_id))
+        time.sleep(0.6)
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+
+    def test_get_wait(self):
+        self.assertEqual(b"NONE", self.send(b"GET 1 10"))
+        self.assertEqual(b"ERROR", self.send(b"GET 1 x"))
+
+    def test_batch(self):
+        task_ids = self.send(b"MADD 1 3 5 12345 3 a b 1 c").split(b" ")
+        self.assertEqual(3, len(task_ids))
+        for task_id in task_ids:
+            self.assertEqual(b"YES", self.send(b"IN 1 " + task_id))
+
+        self.assertEqual(
+            b"%s 5 12345 %s 3 a b" % tuple(task_ids[:2]), self.send(b"MGET 1 2")
+        )
+        self.assertEqual(b"%s 1 c" % task_ids[2], self.send(b"MGET 1 10"))
+        self.assertEqual(b"NONE", self.send(b"MGET 1 10"))
+
+    def test_batch__bad(self):
+        self.assertEqual(b"ERROR", self.send(b"MADD 1 2 5 12345"))
+        self.assertEqual(b"ERROR", self.send(b"MADD 1 x 1 a"))
+        self.assertEqual(b"ERROR", self.send(b"MGET 1 x"))
+
+    def test_stats(self):
+        self.send(b"ADD 1 1 a")
+        self.send(b"ADD 1 1 b")
+        self.send(b"GET 1")
+        self.send(b"ADDD 1 1 a")
+        length, stats = self.send(b"STATS").split(b" ", 1)
+        self.assertEqual(int(length), len(stats))
+        lines = stats.decode().splitlines()
+        self.assertIn('taskqueue_tasks{queue="1",state="created"} 1', lines)
+        self.assertIn('taskqueue_tasks{queue="1",state="running"} 1', lines)
+        self.assertIn('taskqueue_command_seconds_count{command="ADD"} 2', lines)
+        self.assertIn('taskqueue_command_errors_total{command="UNKNOWN"} 1', lines)
+
+
+class ServerTimeoutTest(ServerTestCase):
+    server_args = ["-t", "1"]
+
+    def test_timeout_keeps_order(self):
+        first_task_id = self.send(b"ADD 1 1 a")
+        second_task_id = self.send(b"ADD 1 1 b")
+        self.assertEqual(first_task_id + b" 1 a", self.send(b"GET 1"))
+        self.assertEqual(second_task_id + b" 1 b", self.send(b"GET 1"))
+        third_task_id = self.send(b"ADD 1 1 c")
+        time.sleep(1.1)
+
+        self.assertEqual(first_task_id + b" 1 a", self.send(b"GET 1"))
+        self.assertEqual(second_task_id + b" 1 b", self.send(b"GET 1"))
+        self.assertEqual(third_task_id + b" 1 c", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + first_task_id))
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+
+    def test_batch_timeout(self):
+        first_task_id, second_task_id = self.send(b"MADD 1 2 1 a 1 b").split(b" ")
+        self.assertEqual(first_task_id + b" 1 a", self.send(b"MGET 1 1"))
+        time.sleep(1.1)
+
+        self.assertEqual(
+            first_task_id + b" 1 a " + second_task_id + b" 1 b",
+            self.send(b"MGET 1 5"),
+        )
+
+
+class ServerMetricsTest(ServerTestCase):
+    server_args = ["-e", "5600"]
+
+    def test_exporter(self):
+        self.send(b"ADD 1 1 a")
+        with urllib.request.urlopen("http://127.0.0.1:5600/metrics") as response:
+            self.assertEqual(200, response.status)
+            lines = response.read().decode().splitlines()
+        self.assertIn('taskqueue_tasks{queue="1",state="created"} 1', lines)
+        self.assertIn("# TYPE taskqueue_wal_commit_seconds histogram", lines)
+
+
+class ServerDeadLetterTest(ServerTestCase):
+    server_args = ["-t", "1", "-d", "2", "-s", "3"]
+
+    def test_dead_letter(self):
+        task_id = self.send(b"ADD 1 1 a")
+        other_task_id = self.send(b"ADD 1 1 b")
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+        time.sleep(1.1)
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+        self.assertEqual(other_task_id + b" 1 b", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + other_task_id))
+        time.sleep(1.1)
+
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+        self.assertEqual(b"NO", self.send(b"IN 1 " + task_id))
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+        self.assertEqual(b"0 1 a", self.send(b"GET 1.dlq"))
+        time.sleep(1.1)
+        # Dead letters are never moved any further.
+        self.assertEqual(b"0 1 a", self.send(b"GET 1.dlq"))
+        time.sleep(1.1)
+        self.assertEqual(b"0 1 a", self.send(b"GET 1.dlq"))
+
+    def test_deliveries_survive_restart(self):
+        task_id = self.send(b"ADD 1 1 a")
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+        time.sleep(1.1)
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+        time.sleep(1.1)
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+        self.assertEqual(b"0 1 a", self.send(b"GET 1.dlq"))
+
+
+class ServerPersistenceTest(ServerTestCase):
+    server_args = ["-s", "4"]
+
+    def test_restart(self):
+        first_task_id = self.send(b"ADD 1 5 12345")
+        second_task_id = self.send(b"ADD 1 3 abc")
+        third_task_id = self.send(b"ADD 2 1 x")
+        self.assertEqual(first_task_id + b" 5 12345", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 2 " + third_task_id))
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+
+        self.assertEqual(b"YES", self.send(b"IN 1 " + first_task_id))
+        self.assertEqual(b"NO", self.send(b"IN 2 " + third_task_id))
+        self.assertEqual(second_task_id + b" 3 abc", self.send(b"GET 1"))
+        self.assertEqual(b"NONE", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + first_task_id))
+        self.assertNotIn(self.send(b"ADD 1 1 y"), (first_task_id, second_task_id))
+
+    def test_restart_priorities(self):
+        not_before = time.time() + 1.5
+        for data, options in (
+            (b"a", b""),
+            (b"b", b" 1"),
+            (b"c", b" 2 %f" % not_before),
+            (b"d", b" 3"),
+            (b"e", b" 1"),
+        ):
+            self.send(b"ADD 1 1 " + data + options)
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+
+        self.assertEqual(
+            [b"3 1 d", b"1 1 b", b"4 1 e", b"0 1 a", b"NONE"],
+            [self.send(b"GET 1") for _ in range(5)],
+        )
+        time.sleep(max(not_before - time.time(), 0) + 0.1)
+        self.assertEqual(b"2 1 c", self.send(b"GET 1"))
+
+    def test_crash(self):
+        task_id = self.send(b"ADD 1 5 12345")
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.server.kill()
+        self.server.wait()
+        self.start_server()
+
+        self.assertEqual(task_id + b" 5 12345", self.send(b"GET 1"))
+
+
+class ServerSpillTest(ServerTestCase):
+    server_args = ["-m", "4", "-s", "4"]
+
+    def test_restart(self):
+        task_ids = [
+            self.send(b"ADD 1 %d %s" % (len(data), data))
+            for data in (b"12345", b"ab", b"abcdef", b"xyzw")
+        ]
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_ids[0]))
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+
+        self.assertEqual(b"NO", self.send(b"IN 1 " + task_ids[0]))
+        self.assertEqual(task_ids[1] + b" 2 ab", self.send(b"GET 1"))
+        self.assertEqual(task_ids[2] + b" 6 abcdef", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_ids[2]))
+        self.assertEqual(task_ids[3] + b" 4 xyzw", self.send(b"GET 1"))
+
+    def test_restart_twice(self):
+        spilled = self.send(b"ADD 1 6 abcdef")
+        for _ in range(3):
+            self.send(b"ADD 1 1 x")
+        # The fourth change wrote a snapshot that refers to the spilled task.
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + spilled))
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+        self.restart_server()
+
+        self.assertEqual(b"NO", self.send(b"IN 1 " + spilled))
+        self.assertEqual(b"1 1 x", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 1"))
+        data = self.send(b"ADD 1 4 wxyz")
+        self.restart_server()
+        self.assertEqual(b"YES", self.send(b"IN 1 " + data))
+
+
+class AsyncServerTestCase(ServerTestCase):
+    server_args = ["-a"]
+
+    def connect(self):
+        s = socket.create_connection(("127.0.0.1", 5555))
+        self.addCleanup(s.close)
+        return s, s.makefile("rb")
+
+    def send(self, command):
+        s, responses = self.connect()
+        s.sendall(command + b"\n")
+        return responses.readline().rstrip(b"\n")
+
+
+class AsyncServerTest(AsyncServerTestCase):
+
+    def test_base_scenario(self):
+        task_id = self.send(b"ADD 1 5 12345")
+        self.assertEqual(b"YES", self.send(b"IN 1 " + task_id))
+        self.assertEqual(task_id + b" 5 12345", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_id))
+        self.assertEqual(b"NO", self.send(b"IN 1 " + task_id))
+        self.assertEqual(b"ERROR", self.send(b"ADDD 1 5 12345"))
+
+    def test_pipelining(self):
+        s, responses = self.connect()
+        s.sendall(b"ADD 1 5 12345\nADD 1 3 a\nb\nGET 1\nGET 1\nIN 1 0\nACK 1 0\n")
+        self.assertEqual(
+            [b"0", b"1", b"0 5 12345", b"1 3 a", b"b", b"YES", b"YES"],
+            [responses.readline().rstrip(b"\n") for _ in range(7)],
+        )
+
+    def test_batch_pipelining(self):
+        s, responses = self.connect()
+        s.sendall(b"MADD 1 2 3 a\nb 1 c\nMGET 1 5\nGET 1\n")
+        self.assertEqual(b"0 1\n", responses.readline())
+        self.assertEqual(b"0 3 a\n", responses.readline())
+        self.assertEqual(b"b 1 1 c\n", responses.readline())
+        self.assertEqual(b"NONE\n", responses.readline())
+
+    def test_newline_payload_options(self):
+        s, responses = self.connect()
+        s.sendall(b"ADD 1 1 x\nADD 1 3 a\nb 5\nADD 2 3 a\nb x y z\nGET 1\n")
+        self.assertEqual(b"0\n", responses.readline())
+        self.assertEqual(b"1\n", responses.readline())
+        self.assertEqual(b"ERROR\n", responses.readline())
+        # The priority after the payload is kept.
+        self.assertEqual(b"1 3 a\n", responses.readline())
+        self.assertEqual(b"b\n", responses.readline())
+
+    def test_long_line(self):
+        data = b"x" * 200_000
+        task_id = self.send(b"ADD 1 %d %s" % (len(data), data))
+        s, responses = self.connect()
+        s.sendall(b"GET 1\n")
+        expected = b"%s %d %s\n" % (task_id, len(data), data)
+        self.assertEqual(expected, responses.readline())
+
+    def test_many_connections(self):
+        connections = [self.connect() for _ in range(200)]
+        for i, (s, _) in enumerate(connections):
+            s.sendall(b"ADD %d 1 x\n" % (i % 10))
+        for s, responses in connections:
+            self.assertTrue(responses.readline().rstrip(b"\n").isdigit())
+            s.sendall(b"GET 0\n")
+        leased = [responses.readline() for _, responses in connections]
+        self.assertEqual(180, leased.count(b"NONE\n"))
+
+    def test_long_poll(self):
+        consumers = []
+        for _ in range(3):
+            s, responses = self.connect()
+            s.sendall(b"GET 1 10\n")
+            consumers.append(responses)
+            time.sleep(0.1)
+        first, second = self.send(b"ADD 1 1 a"), self.send(b"ADD 1 1 b")
+        self.assertEqual(first + b" 1 a\n", consumers[0].readline())
+        self.assertEqual(second + b" 1 b\n", consumers[1].readline())
+
+        s, responses = self.connect()
+        s.sendall(b"GET 3 10\n")
+        self.send(b"ADD 3 1 c 0 %f" % (time.time() + 0.3))
+        self.assertEqual(b"0 1 c\n", responses.readline())
+
+        started = time.monotonic()
+        self.assertEqual(b"NONE", self.send(b"GET 2 0.2"))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(b"ERROR", self.send(b"GET 2 inf"))
+
+
+class AsyncTimeoutTest(AsyncServerTestCase):
+    server_args = ["-a", "-t", "1"]
+
+    def test_long_poll_expired(self):
+        task_id = self.send(b"ADD 1 1 a")
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1"))
+        started = time.monotonic()
+        self.assertEqual(task_id + b" 1 a", self.send(b"GET 1 5"))
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class ReplicationTest(AsyncServerTestCase):
+    server_args = ["-y", "-m", "4"]
+
+    def setUp(self):
+        super().setUp()
+        self.standby_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.standby_dir.cleanup)
+        self.start_standby()
+
+    def tearDown(self):
+        self.standby.terminate()
+        self.standby.wait()
+        super().tearDown()
+
+    def start_standby(self):
+        self.standby = subprocess.Popen(
+            [
+                sys.executable,
+                SERVER_PATH,
+                "-c",
+                self.standby_dir.name,
+                "-p",
+                "5556",
+                "-r",
+                "127.0.0.1:5555",
+            ]
+        )
+        time.sleep(0.5)
+
+    def send_standby(self, command):
+        s = socket.create_connection(("127.0.0.1", 5556))
+        self.addCleanup(s.close)
+        s.sendall(command + b"\n")
+        return s.makefile("rb").readline().rstrip(b"\n")
+
+    def test_failover(self):
+        # Primary had tasks before the standby came, some spilled to disk.
+        acked = self.send(b"ADD 1 5 12345")
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + acked))
+        self.restart_standby()
+        first = self.send(b"ADD 1 6 abcdef")
+        second = self.send(b"ADD 1 2 ab 5")
+        third = self.send(b"ADD 2 1 x")
+        self.assertEqual(second + b" 2 ab", self.send(b"GET 1"))
+        self.assertEqual(b"YES", self.send(b"ACK 2 " + third))
+
+        self.assertEqual(b"ERROR", self.send_standby(b"ADD 1 1 y"))
+        self.assertEqual(b"ERROR", self.send_standby(b"GET 1"))
+        # Synchronous, so the standby has the changes once they are answered.
+        self.assertEqual(b"YES", self.send_standby(b"IN 1 " + second))
+        self.assertEqual(b"NO", self.send_standby(b"IN 2 " + third))
+        self.stop_server()
+
+        self.assertEqual(b"OK", self.send_standby(b"PROMOTE"))
+        self.assertEqual(first + b" 6 abcdef", self.send_standby(b"GET 1"))
+        self.assertEqual(b"NONE", self.send_standby(b"GET 1"))
+        self.assertEqual(b"YES", self.send_standby(b"ACK 1 " + second))
+        self.assertNotIn(self.send_standby(b"ADD 1 1 y"), (acked, first, second))
+
+    def test_standby_stats(self):
+        task_ids = [self.send(b"ADD 1 1 %d" % i) for i in range(3)]
+        self.send(b"GET 1")
+        self.send(b"GET 1")
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_ids[0]))
+        self.assertEqual(b"YES", self.send(b"ACK 1 " + task_ids[2]))
+
+        s = socket.create_connection(("127.0.0.1", 5556))
+        self.addCleanup(s.close)
+        s.sendall(b"STATS\n")
+        responses = s.makefile("rb")
+        length = int(b"".join(iter(lambda: responses.read(1), b" ")))
+        lines = responses.read(length).decode().splitlines()
+        self.assertIn('taskqueue_tasks{queue="1",state="created"} 0', lines)
+        self.assertIn('taskqueue_tasks{queue="1",state="running"} 1', lines)
+
+    def restart_standby(self):
+        self.standby.terminate()
+        self.standby.wait()
+        self.start_standby()
+
+    def test_primary_restart(self):
+        task_id = self.send(b"ADD 1 5 12345")
+        self.restart_server()
+        # The standby reconnects and starts over from the primary's state.
+        self.assertEqual(task_id + b" 5 12345", self.send(b"GET 1"))
+        added = self.send(b"ADD 1 3 abc")
+        self.assertEqual(b"YES", self.send_standby(b"IN 1 " + added))
+        self.assertEqual(b"YES", self.send_standby(b"IN 1 " + task_id))
+
+        self.restart_standby()
+        self.assertEqual(b"YES", self.send_standby(b"IN 1 " + added))
+        self.assertEqual(b"OK", self.send_standby(b"PROMOTE"))
+        self.assertEqual(b"OK", self.send_standby(b"PROMOTE"))
+        self.assertEqual(added + b" 3 abc", self.send_standby(b"GET 1"))
+
+
+class ShardedServerTest(AsyncServerTest):
+    server_args = ["-w", "3"]
+
+    def test_many_queues(self):
+        queues = [b"queue-%d" % i for i in range(30)]
+        task_ids = {queue: self.send(b"ADD " + queue + b" 1 x") for queue in queues}
+        self.assertEqual(b"OK", self.send(b"SAVE"))
+        self.restart_server()
+
+        s, responses = self.connect()
+        for queue in queues:
+            s.sendall(b"IN " + queue + b" " + task_ids[queue] + b"\n")
+            s.sendall(b"GET " + queue + b"\n")
+            s.sendall(b"ACK " + queue + b" " + task_ids[queue] + b"\n")
+        for queue in queues:
+            self.assertEqual(b"YES\n", responses.readline())
+            self.assertEqual(task_ids[queue] + b" 1 x\n", responses.readline())
+            self.assertEqual(b"YES\n", responses.readline())
+
+
+class BinaryProtocolTest(ServerTestCase):
+    server_args = ["-a"]
+
+    def setUp(self):
+        super().setUp()
+        self.socket = socket.create_connection(("127.0.0.1", 5555))
+        self.addCleanup(self.socket.close)
+        self.responses = self.socket.makefile("rb")
+        self.socket.sendall(MAGIC)
+        self.assertEqual(MAGIC, self.responses.read(len(MAGIC)))
+
+    def request(self, opcode, *chunks):
+        body = b"".join(chunks)
+        self.socket.sendall(HEADER.pack(opcode, len(body)) + body)
+        status, length = HEADER.unpack(self.responses.read(HEADER.size))
+        return status, self.responses.read(length)
+
+    def test_base_scenario(self):
+        queue = pack_string(b"1")
+        payload = bytes(range(256)) * 1000
+        status, task_id = self.request(Opcode.ADD, queue, payload)
+        task_id = pack_string(task_id)
+        self.assertEqual(Status.OK, status)
+        self.assertEqual((Status.OK, b""), self.request(Opcode.IN, queue, task_id))
+
+        response = self.request(Opcode.GET, queue)
+        self.assertEqual((Status.OK, task_id + payload), response)
+        self.assertEqual((Status.NO, b""), self.request(Opcode.GET, queue))
+        self.assertEqual((Status.OK, b""), self.request(Opcode.ACK, queue, task_id))
+        self.assertEqual((Status.NO, b""), self.request(Opcode.ACK, queue, task_id))
+        self.assertEqual((Status.NO, b""), self.request(Opcode.IN, queue, task_id))
+        self.assertEqual((Status.OK, b""), self.request(Opcode.SAVE))
+
+    def test_batch(self):
+        queue = pack_string(b"1")
+        first, second = pack_payload(b"a b"), pack_payload(b"\n")
+        self.assertEqual(
+            (Status.OK, pack_string(b"0") + pack_string(b"1")),
+            self.request(Opcode.MADD, queue, first, second),
+        )
+        self.assertEqual(
+            (Status.OK, pack_string(b"0") + first + pack_string(b"1") + second),
+            self.request(Opcode.MGET, queue, b"\x00\x00\x00\x05"),
+        )
+        self.assertEqual((Status.NO, b""), self.request(Opcode.MGET, queue, b"\0" * 4))
+
+    def test_long_poll(self):
+        queue = pack_string(b"1")
+        self.socket.sendall(HEADER.pack(Opcode.GET, len(queue) + 4) + queue)
+        self.socket.sendall(WAIT.pack(10_000))
+        time.sleep(0.1)
+        producer = socket.create_connection(("127.0.0.1", 5555))
+        self.addCleanup(producer.close)
+        producer.sendall(b"ADD 1 5 12345\n")
+        status, length = HEADER.unpack(self.responses.read(HEADER.size))
+        self.assertEqual(
+            (Status.OK, pack_string(b"0") + b"12345"),
+            (status, self.responses.read(length)),
+        )
+        response = self.request(Opcode.GET, queue, WAIT.pack(1))
+        self.assertEqual((Status.NO, b""), response)
+
+    def test_schedule(self):
+        queue = pack_string(b"1")
+        self.request(Opcode.ADD, queue, b"a")
+        self.request(Opcode.SCHEDULE, queue, SCHEDULE.pack(2, 0.0), b"b")
+        self.request(Opcode.SCHEDULE, queue, SCHEDULE.pack(9, time.time() + 60), b"c")
+        self.assertEqual(
+            (Status.OK, pack_string(b"1") + b"b"), self.request(Opcode.GET, queue)
+        )
+        self.assertEqual(
+            (Status.OK, pack_string(b"0") + b"a"), self.request(Opcode.GET, queue)
+        )
+        self.assertEqual((Status.NO, b""), self.request(Opcode.GET, queue))
+
+    def test_stats(self):
+        self.request(Opcode.ADD, pack_string(b"1"), b"12345")
+        status, stats = self.request(Opcode.STATS)
+        self.assertEqual(Status.OK, status)
+        self.assertIn(b'queue="1",state="created"} 1\n', stats)
+        self.assertEqual(1, stats.count(b'state="created"} 1\n'))
+
+    def test_wrong_request(self):
+        self.assertEqual((Status.ERROR, b""), self.request(Opcode.GET, b"\x00\x05ab"))
+        self.assertEqual((Status.ERROR, b""), self.request(42, pack_string(b"1")))
+
+    def test_text_clients(self):
+        status, task_id = self.request(Opcode.ADD, pack_string(b"1"), b"12345")
+        text = socket.create_connection(("127.0.0.1", 5555))
+        self.addCleanup(text.close)
+        text.sendall(b"GET 1\n")
+        self.assertEqual(task_id + b" 5 12345\n", text.makefile("rb").readline())
+
+
+class ShardedBinaryProtocolTest(BinaryProtocolTest):
+    server_args = ["-w", "3"]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,152 @@
+import os
+import struct
+import time
+import zlib
+from enum import IntEnum
+
+MAGIC = b"TQWAL2"
+FILE_HEADER = struct.Struct("<6sQ")
+RECORD_HEADER = struct.Struct("<II")
+FIELD_LENGTH = struct.Struct("<I")
+# Priority and not-before time of a SCHEDULE record.
+SCHEDULE_OPTIONS = struct.Struct("<id")
+
+
+class Op(IntEnum):
+    ADD = 1
+    GET = 2
+    ACK = 3
+    SCHEDULE = 4
+    DEAD_LETTER = 5
+
+
+def decode_body(body):
+    fields = []
+    offset = 1
+    while offset < len(body):
+        (length,) = FIELD_LENGTH.unpack_from(body, offset)
+        offset += FIELD_LENGTH.size
+        fields.append(bytes(body[offset : offset + length]))
+        offset += length
+    return Op(body[0]), fields
+
+
+def encode_body(op, fields):
+    """Returns the chunks of a record body, fields are not copied."""
+    chunks = [bytes([op])]
+    for value in fields:
+        chunks += [FIELD_LENGTH.pack(len(value)), value]
+    return chunks
+
+
+class WriteAheadLog:
+    """Binary append-only log of queue changes with group commit.
+
+    Records are buffered and written with a single fsync once `fsync_batch`
+    of them are pending or `fsync_interval` seconds have passed since the
+    last commit, so a crash loses at most one such window. The duration of
+    every commit is recorded in `commit_times` when it is given.
+    """
+
+    def __init__(self, path, fsync_batch=128, fsync_interval=0.01, commit_times=None):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.commit_times = commit_times
+
+        self.generation = 0
+        self.file = None
+        self.pending = 0
+        self.records = 0
+        self.last_commit = time.monotonic()
+
+    def replay(self, generation):
+        """Yields (op, fields) for every intact record of `generation`.
+
+        A torn record at the tail, left by a crash mid-write, ends the replay
+        and is cut off so new records are appended right after the last
+        good one.
+        """
+        self.generation = generation
+        if not os.path.exists(self.path):
+            self.reset(generation)
+            return
+        with open(self.path, "rb") as f:
+            # Read record by record, only one of them is in memory at a time.
+            size = os.fstat(f.fileno()).st_size
+            header = f.read(FILE_HEADER.size)
+            magic, file_generation = (
+                FILE_HEADER.unpack(header)
+                if len(header) == FILE_HEADER.size
+                else (None, None)
+            )
+            if magic != MAGIC or file_generation != generation:
+                # Left over from before the last snapshot: already included in it.
+                self.reset(generation)
+                return
+
+            offset = FILE_HEADER.size
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                start = offset + RECORD_HEADER.size
+                # A torn header may hold any length, the file bounds it.
+                if length > size - start:
+                    break
+                body = f.read(length)
+                if zlib.crc32(body) != crc:
+                    break
+                offset = start + length
+                self.records += 1
+                yield decode_body(memoryview(body))
+
+        self.file = open(self.path, "r+b")
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def append(self, op, *fields):
+        # Fields are written one by one, so large payloads are not copied
+        # into an intermediate record first.
+        chunks = encode_body(op, fields)
+        crc = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+        self.file.write(RECORD_HEADER.pack(sum(map(len, chunks)), crc))
+        for chunk in chunks:
+            self.file.write(chunk)
+        self.pending += 1
+        self.records += 1
+        if self.pending >= self.fsync_batch:
+            self.commit()
+
+    def commit(self):
+        if self.pending == 0:
+            return
+        started = time.monotonic_ns()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_commit = time.monotonic()
+        if self.commit_times is not None:
+            self.commit_times.record(time.monotonic_ns() - started)
+
+    def tick(self):
+        if self.pending and time.monotonic() - self.last_commit >= self.fsync_interval:
+            self.commit()
+
+    def reset(self, generation):
+        """Starts an empty log for `generation`, dropping all records."""
+        if self.file is not None:
+            self.file.close()
+        self.generation = generation
+        self.file = open(self.path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, generation))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.commit()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,185 @@
+"""Persistent rope: a text kept as an implicit treap of string chunks.
+
+Nodes are never changed once built. An edit splits the tree at the edit
+position and merges it back, copying only the O(log n) nodes on the paths
+it walks, so the old and the new version share everything else and an old
+Rope stays valid and cheap to keep.
+"""
+
+import random
+from typing import Iterator
+
+# Longest chunk a node keeps, longer texts are split into several nodes.
+CHUNK_SIZE = 1024
+
+
+class Node:
+    __slots__ = ("chunk", "left", "right", "priority", "size")
+
+    def __init__(
+        self,
+        chunk: str,
+        left: "Node | None" = None,
+        right: "Node | None" = None,
+        priority: float | None = None,
+    ) -> None:
+        self.chunk = chunk
+        self.left = left
+        self.right = right
+        self.priority = random.random() if priority is None else priority
+        self.size = (
+            len(chunk)
+            + (left.size if left is not None else 0)
+            + (right.size if right is not None else 0)
+        )
+
+
+def size(node: Node | None) -> int:
+    return node.size if node is not None else 0
+
+
+def merge(left: Node | None, right: Node | None) -> Node | None:
+    """Returns a tree of the text of `left` followed by the text of `right`."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return Node(left.chunk, left.left, merge(left.right, right), left.priority)
+    return Node(right.chunk, merge(left, right.left), right.right, right.priority)
+
+
+def split(node: Node | None, index: int) -> tuple[Node | None, Node | None]:
+    """Returns trees of the first `index` characters and of the rest."""
+    if node is None or index <= 0:
+        return None, node
+    if index >= node.size:
+        return node, None
+    left_size = size(node.left)
+    if index <= left_size:
+        left, right = split(node.left, index)
+        return left, Node(node.chunk, right, node.right, node.priority)
+    end = left_size + len(node.chunk)
+    if index >= end:
+        left, right = split(node.right, index - end)
+        return Node(node.chunk, node.left, left, node.priority), right
+    # The split falls inside the chunk, each half keeps its own subtree.
+    cut = index - left_size
+    return (
+        Node(node.chunk[:cut], node.left, None, node.priority),
+        Node(node.chunk[cut:], None, node.right, node.priority),
+    )
+
+
+def build(text: str) -> Node | None:
+    root = None
+    for start in range(0, len(text), CHUNK_SIZE):
+        root = merge(root, Node(text[start : start + CHUNK_SIZE]))
+    return root
+
+
+def append_to_last(node: Node, text: str) -> Node:
+    # Copies the right spine down to the last chunk, which gets `text`.
+    if node.right is None:
+        return Node(node.chunk + text, node.left, None, node.priority)
+    return Node(node.chunk, node.left, append_to_last(node.right, text), node.priority)
+
+
+def drop_first(node: Node) -> Node | None:
+    if node.left is None:
+        return node.right
+    return Node(node.chunk, drop_first(node.left), node.right, node.priority)
+
+
+def last_chunk(node: Node) -> str:
+    while node.right is not None:
+        node = node.right
+    return node.chunk
+
+
+def first_chunk(node: Node) -> str:
+    while node.left is not None:
+        node = node.left
+    return node.chunk
+
+
+def join(left: Node | None, right: Node | None) -> Node | None:
+    """Merges two trees, fusing the chunks that meet if they fit in one.
+
+    Edits split chunks, fusing them back keeps the number of nodes, and so
+    the depth of the tree, from growing with every edit.
+    """
+    if left is None or right is None:
+        return left or right
+    first = first_chunk(right)
+    if len(last_chunk(left)) + len(first) <= CHUNK_SIZE:
+        left = append_to_last(left, first)
+        right = drop_first(right)
+    return merge(left, right)
+
+
+class Rope:
+    """Immutable text with O(log n) insert, delete and replace.
+
+    Chunks that meet at an edit are fused while they fit in CHUNK_SIZE, so
+    typing at a cursor does not leave a node per keystroke.
+    """
+
+    __slots__ = ("root",)
+
+    def __init__(self, text: str = "", root: Node | None = None) -> None:
+        self.root = root if root is not None else build(text)
+
+    def __len__(self) -> int:
+        return size(self.root)
+
+    def __str__(self) -> str:
+        return "".join(self.chunks())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Rope):
+            return len(self) == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    def chunks(self, start: int = 0, stop: int | None = None) -> Iterator[str]:
+        """Yields the text between `start` and `stop` chunk by chunk."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        # In-order walk with an explicit stack, skipping whole subtrees that
+        # lie outside of the range.
+        stack = []
+        node, offset = self.root, 0
+        while (stack or node is not None) and offset < stop:
+            if node is not None:
+                if offset + node.size <= start:
+                    offset += node.size
+                    node = None
+                    continue
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            chunk_start = offset
+            offset += len(node.chunk)
+            if offset > start and chunk_start < stop:
+                yield node.chunk[max(start - chunk_start, 0) : stop - chunk_start]
+            node = node.right
+
+    def substring(self, start: int, stop: int) -> str:
+        return "".join(self.chunks(start, stop))
+
+    def insert(self, pos: int, text: str) -> "Rope":
+        if not text:
+            return self
+        left, right = split(self.root, pos)
+        return Rope(root=join(join(left, build(text)), right))
+
+    def delete(self, pos: int, length: int) -> "Rope":
+        if length <= 0:
+            return self
+        left, rest = split(self.root, pos)
+        _, right = split(rest, length)
+        return Rope(root=join(left, right))
+
+    def replace(self, pos: int, text: str) -> "Rope":
+        """Overwrites len(text) characters from `pos`, extending past the end."""
+        return self.delete(pos, len(text)).insert(pos, text)
@@ -0,0 +1,170 @@
+"""File storage of a text history.
+
+Actions are fixed-size records appended to `<path>`, so record i is found
+without an index, and the text they insert and remove is appended to
+`<path>.text`. Both are read back through mmap. `<path>.snapshot` holds
+the text and the version after some number of actions, opening a history
+only replays the records after it.
+"""
+
+import mmap
+import os
+import struct
+
+MAGIC = b"THLOG1"
+# Kind, position, from and to versions, start of the text in the text
+# file, a length of the caller's own, lengths of the inserted and of the
+# removed text in bytes.
+RECORD = struct.Struct("<BqqqQIII")
+TO_VERSION = struct.Struct("<q")
+TO_VERSION_OFFSET = struct.calcsize("<Bqq")
+SNAPSHOT_MAGIC = b"THSNP2"
+# Number of actions the snapshot text is after and the version it is of.
+SNAPSHOT_HEADER = struct.Struct("<6sQq")
+# Removed length of an action whose removed text is not known.
+UNKNOWN = 0xFFFFFFFF
+
+
+class Mapping:
+    """Read-only mmap of an append-only file, remapped as it grows."""
+
+    def __init__(self, file):
+        self.file = file
+        self.mmap = None
+
+    def read(self, start, stop):
+        if start >= stop:
+            return b""
+        if self.mmap is None or stop > len(self.mmap):
+            self.close()
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmap[start:stop]
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+
+class ActionFile:
+    """Append-only file of action records and the text they carry.
+
+    A torn record at the tail, left by a crash mid-write, is cut off on
+    open. Records are flushed as they are appended, the OS decides when
+    they reach the disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = self.open(path, MAGIC)
+        self.text = self.open(path + ".text", b"")
+        size = os.fstat(self.records.fileno()).st_size - len(MAGIC)
+        self.count = size // RECORD.size
+        self.records.truncate(len(MAGIC) + self.count * RECORD.size)
+        self.records.seek(0, os.SEEK_END)
+        self.text_size = os.fstat(self.text.fileno()).st_size
+        self.record_map = Mapping(self.records)
+        self.text_map = Mapping(self.text)
+
+    @staticmethod
+    def open(path, magic):
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(magic)
+        f = open(path, "r+b")
+        if f.read(len(magic)) != magic:
+            f.close()
+            raise ValueError(f"{path} is not a text history log")
+        return f
+
+    def __len__(self):
+        return self.count
+
+    def append(self, kind, pos, from_version, to_version, length, text, removed):
+        """Appends a record, `removed` is None if it is not known."""
+        start = self.text_size
+        # The text goes first, a record never points past the end of it.
+        self.text.seek(start)
+        self.text.write(text)
+        if removed is not None:
+            self.text.write(removed)
+        self.text.flush()
+        self.text_size += len(text) + len(removed or b"")
+        removed_length = UNKNOWN if removed is None else len(removed)
+        self.records.write(
+            RECORD.pack(
+                kind,
+                pos,
+                from_version,
+                to_version,
+                start,
+                length,
+                len(text),
+                removed_length,
+            )
+        )
+        self.records.flush()
+        self.count += 1
+
+    def record(self, index):
+        """Returns (kind, pos, from_version, to_version, length, text, removed)."""
+        offset = len(MAGIC) + index * RECORD.size
+        record = RECORD.unpack(self.record_map.read(offset, offset + RECORD.size))
+        *fields, start, length, text_length, removed_length = record
+        text = self.text_map.read(start, start + text_length)
+        removed = None
+        if removed_length != UNKNOWN:
+            start += text_length
+            removed = self.text_map.read(start, start + removed_length)
+        return (*fields, length, text, removed)
+
+    def to_version(self, index):
+        offset = len(MAGIC) + index * RECORD.size + TO_VERSION_OFFSET
+        (to_version,) = TO_VERSION.unpack(
+            self.record_map.read(offset, offset + TO_VERSION.size)
+        )
+        return to_version
+
+    def truncate(self, count):
+        """Drops the records from `count` on, and the text they carry."""
+        if count < self.count:
+            offset = len(MAGIC) + count * RECORD.size
+            record = RECORD.unpack(self.record_map.read(offset, offset + RECORD.size))
+            start = record[4]
+            self.record_map.close()
+            self.text_map.close()
+            self.records.truncate(offset)
+            self.records.seek(offset)
+            self.text.truncate(start)
+            self.text_size = start
+            self.count = count
+
+    def read_snapshot(self):
+        """Returns (count, version, text) of the snapshot, (0, 0, "") if none."""
+        try:
+            with open(self.path + ".snapshot", "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0, 0, ""
+        if len(data) < SNAPSHOT_HEADER.size:
+            return 0, 0, ""
+        magic, count, version = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or count > self.count:
+            return 0, 0, ""
+        return count, version, data[SNAPSHOT_HEADER.size :].decode()
+
+    def write_snapshot(self, count, version, text):
+        # Written aside and renamed, so a crash leaves the old one whole.
+        path = self.path + ".snapshot"
+        with open(path + ".tmp", "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, version))
+            f.write(text.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        self.record_map.close()
+        self.text_map.close()
+        self.records.close()
+        self.text.close()
@@ -0,0 +1,54 @@
+import random
+from unittest import TestCase
+
+import rope
+from rope import Rope
+
+
+class RopeTestCase(TestCase):
+    def test_edits(self):
+        r = Rope("abc")
+        r = r.insert(1, "xyz")
+        self.assertEqual("axyzbc", str(r))
+        r = r.delete(0, 2)
+        self.assertEqual("yzbc", str(r))
+        r = r.replace(3, "END")
+        self.assertEqual("yzbEND", str(r))
+        self.assertEqual(6, len(r))
+        self.assertEqual("bEN", r.substring(2, 5))
+
+    def test_persistent(self):
+        old = Rope("hello world")
+        new = old.insert(5, ",").delete(0, 1)
+        self.assertEqual("hello world", str(old))
+        self.assertEqual("ello, world", str(new))
+
+    def test_random_against_str(self):
+        random.seed(1)
+        text = "".join(random.choice("abcdef") for _ in range(5000))
+        r = Rope(text)
+        for _ in range(2000):
+            pos = random.randint(0, len(text))
+            match random.choice(("insert", "delete", "replace")):
+                case "insert":
+                    new = "x" * random.choice((1, 3, 2000))
+                    text = text[:pos] + new + text[pos:]
+                    r = r.insert(pos, new)
+                case "delete":
+                    length = random.randint(0, len(text) - pos)
+                    text = text[:pos] + text[pos + length :]
+                    r = r.delete(pos, length)
+                case "replace":
+                    new = "y" * random.randint(1, 50)
+                    text = text[:pos] + new + text[pos + len(new) :]
+                    r = r.replace(pos, new)
+            self.assertEqual(len(text), len(r))
+        self.assertEqual(text, str(r))
+        start = random.randint(0, len(text))
+        self.assertEqual(text[start : start + 3000], r.substring(start, start + 3000))
+
+    def test_typing_fills_chunks(self):
+        r = Rope()
+        for i in range(rope.CHUNK_SIZE * 3):
+            r = r.insert(i, "a")
+        self.assertEqual(3, len(list(r.chunks())))
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from itertools import pairwise
+from unittest import TestCase
+
+from storage import RECORD
+from text_history import DeleteAction, InsertAction, TextHistory
+
+
+class StorageTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "doc")
+
+    def test_reopen(self):
+        with TextHistory(path=self.path, checkpoint_every=3, snapshot_every=5) as h:
+            for i in range(12):
+                h.insert("ж%d" % i, pos=0)
+            h.delete(pos=0, length=2)
+            h.action(InsertAction(pos=None, text="!", from_version=13, to_version=20))
+            texts = [h.text_at(version) for version in range(21)]
+        # Closing wrote a snapshot of the latest text.
+        self.assertEqual(14, h._snapshot_count)
+
+        with TextHistory(path=self.path, checkpoint_every=3) as h:
+            self.assertEqual(20, h.version)
+            self.assertEqual(texts[-1], h.text)
+            self.assertEqual(texts, [h.text_at(version) for version in range(21)])
+            self.assertEqual(DeleteAction(0, 2, 12, 13), h.get_actions(12, 13)[0])
+            h.insert("?")
+            self.assertEqual(1, h.compact(12, 21))
+
+        with TextHistory(path=self.path) as h:
+            self.assertEqual(texts[-1] + "?", h.text)
+            self.assertEqual(texts[12], h.text_at(12))
+            self.assertEqual(14, len(h.actions))
+
+    def test_compact_to_nothing(self):
+        with TextHistory(path=self.path) as h:
+            h.insert("abc")
+            h.insert("x")
+            h.delete(pos=3, length=1)
+            self.assertEqual(1, h.compact(1, 3))
+            self.assertEqual(InsertAction(3, "", 1, 3), h.get_actions(1, 3)[0])
+
+        with TextHistory(path=self.path) as h:
+            self.assertEqual(3, h.version)
+            self.assertEqual("abc", h.text_at(2))
+            h.insert("d")
+            self.assertEqual((3, 4), (h.actions[-1].from_version, h.version))
+
+    def test_reopen_checkpoints(self):
+        with TextHistory(path=self.path, checkpoint_every=4) as h:
+            for i in range(40):
+                h.insert("%d," % i)
+            texts = [h.text_at(version) for version in range(41)]
+
+        with TextHistory(path=self.path, checkpoint_every=4) as h:
+            self.assertEqual([0, 40], h._checkpoint_counts)
+            self.assertEqual(texts[7], h.text_at(7))
+            self.assertEqual(texts[30], h.text_at(30))
+            self.assertEqual([0, 4, 32, 36, 40], h._checkpoint_counts)
+            self.assertEqual(texts, [h.text_at(version) for version in range(41)])
+            self.assertTrue(all(b - a <= 4 for a, b in pairwise(h._checkpoint_counts)))
+
+    def test_snapshot_version(self):
+        with TextHistory(path=self.path) as h:
+            h.insert("ab")
+            h.action(InsertAction(pos=None, text="c", from_version=1, to_version=9))
+        self.assertEqual((2, 9, "abc"), h.actions.file.read_snapshot())
+
+        with TextHistory(path=self.path) as h:
+            self.assertEqual(9, h.version)
+            h.insert("d")
+            self.assertEqual((9, 10), (h.actions[-1].from_version, h.version))
+
+    def test_torn_tail(self):
+        h = TextHistory(path=self.path, snapshot_every=2)
+        for char in "abcde":
+            h.insert(char)
+        h.actions.close()
+        # Crashed in the middle of the last record, after the snapshot.
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - RECORD.size // 2)
+
+        with TextHistory(path=self.path) as h:
+            self.assertEqual("abcd", h.text)
+            self.assertEqual(4, h.version)
+            h.insert("f")
+            self.assertEqual("abcdf", h.text)
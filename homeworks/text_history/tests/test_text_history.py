@@ -1,6 +1,13 @@
+import random
 from unittest import TestCase
 
-from text_history import TextHistory, InsertAction, ReplaceAction, DeleteAction
+from text_history import (
+    ActionLog,
+    DeleteAction,
+    InsertAction,
+    ReplaceAction,
+    TextHistory,
+)
 
 
 class TextHistoryTestCase(TestCase):
@@ -26,6 +33,12 @@ class TextHistoryTestCase(TestCase):
         self.assertEqual("abc", h.text)
         self.assertEqual(10, h.version)
 
+    def test_hash(self):
+        self.assertEqual(
+            {InsertAction(0, "a", 0, 1)},
+            {InsertAction(0, "a", 0, 1), InsertAction(0, "a", 0, 1)},
+        )
+
     def test_action__bad(self):
         h = TextHistory()
         action = InsertAction(pos=0, text="abc", from_version=10, to_version=10)
@@ -171,3 +184,215 @@ class TextHistoryTestCase(TestCase):
 
         h.insert("a")
         self.assertEqual([], h.get_actions(0, 0))
+
+    def test_text_at(self):
+        h = TextHistory(checkpoint_every=4, cache_size=2)
+        texts = [h.text]
+        random.seed(2)
+        for _ in range(30):
+            pos = random.randint(0, len(h.text))
+            match random.choice(("insert", "append", "replace", "delete")):
+                case "insert":
+                    h.insert("xy", pos)
+                case "append":
+                    h.insert("z")
+                case "replace":
+                    h.replace("RR", pos)
+                case "delete":
+                    h.delete(pos, random.randint(0, len(h.text) - pos))
+            texts.append(h.text)
+        h.action(InsertAction(pos=0, text="!", from_version=30, to_version=40))
+        texts += [texts[-1]] * 9 + [h.text]
+
+        for version in random.sample(range(41), 41) * 2:
+            self.assertEqual(texts[version], h.text_at(version))
+        with self.assertRaises(ValueError):
+            h.text_at(41)
+        with self.assertRaises(ValueError):
+            h.text_at(-1)
+
+    def test_get_actions__range(self):
+        h = TextHistory()
+        for i in range(10):
+            h.insert(str(i))
+        h.action(InsertAction(pos=0, text="x", from_version=10, to_version=20))
+
+        actions = h.get_actions(3, 15)
+        self.assertEqual(h.actions[3:10], actions)
+        self.assertEqual([4, 5], [a.to_version for a in actions[:2]])
+        self.assertEqual(10, actions[-1].to_version)
+        self.assertEqual(h.actions[3:], h.get_actions(3))
+        self.assertEqual(h.actions[10:], h.get_actions(12, 20))
+        self.assertEqual([], h.get_actions(12, 19))
+
+    def test_compact(self):
+        h = TextHistory(checkpoint_every=3)
+        for char in "hello world":
+            h.insert(char)
+        h.delete(pos=6, length=5)
+        h.insert("there")
+        h.insert("!", pos=0)
+        h.delete(pos=0, length=1)
+        h.replace("H", pos=0)
+
+        self.assertEqual(14, h.compact(0, 15))
+        self.assertEqual("Hello there", h.text)
+        insert, replace = h.get_actions()
+        self.assertIsInstance(insert, InsertAction)
+        self.assertEqual((0, 15), (insert.from_version, insert.to_version))
+        self.assertEqual("hello there", insert.new_text)
+        self.assertEqual(16, replace.to_version)
+        self.assertEqual("hello there", h.text_at(15))
+        self.assertEqual("", h.text_at(0))
+        self.assertEqual(1, h.compact())
+        (insert,) = h.get_actions()
+        self.assertEqual("Hello there", insert.new_text)
+        self.assertEqual(0, h.compact())
+
+    def test_columnar(self):
+        h = TextHistory(checkpoint_every=2, columnar=True)
+        h.insert("абв")
+        h.insert("x", pos=1)
+        h.replace("Y", pos=0)
+        h.delete(pos=2, length=2)
+        h.action(InsertAction(pos=None, text="!", from_version=4, to_version=10))
+        self.assertEqual("Yx!", h.text)
+        self.assertIsInstance(h.actions, ActionLog)
+
+        insert, replace = h.get_actions(1, 3)
+        self.assertEqual(InsertAction(1, "x", 1, 2), insert)
+        self.assertEqual(ReplaceAction(0, "Y", 2, 3), replace)
+        self.assertEqual(DeleteAction(2, 2, 3, 4), h.actions[3])
+        self.assertEqual(InsertAction(None, "!", 4, 10), h.actions[-1])
+        self.assertEqual("Yxбв", h.text_at(3))
+        self.assertEqual(4, h.compact())
+        self.assertEqual([InsertAction(0, "Yx!", 0, 10)], h.actions[:])
+
+    def test_action__concurrent(self):
+        h = TextHistory()
+        h.insert("hello world")
+        # Three writers start from version 1, the first one to come wins.
+        self.assertEqual(2, h.action(InsertAction(6, "big ", 1, 2)))
+        self.assertEqual(3, h.action(DeleteAction(0, 6, 1, 2)))
+        self.assertEqual("big world", h.text)
+        self.assertEqual(10, h.action(ReplaceAction(6, "W", 1, 10)))
+        self.assertEqual("big World", h.text)
+        self.assertEqual(11, h.action(InsertAction(None, "!", 2, 3)))
+        self.assertEqual("big World!", h.text)
+
+        # Both deleted the same text, and an insert lands after the
+        # insert made at the same place before it.
+        self.assertEqual(12, h.action(DeleteAction(0, 4, 11, 12)))
+        self.assertEqual(12, h.action(DeleteAction(0, 4, 11, 12)))
+        h.action(InsertAction(0, "a", 12, 13))
+        h.action(InsertAction(0, "b", 12, 13))
+        self.assertEqual("abWorld!", h.text)
+        self.assertEqual("World!", h.text_at(12))
+
+        with self.assertRaises(ValueError):
+            h.action(DeleteAction(0, 10, 12, 13))
+
+    def test_action__edited_since(self):
+        h = TextHistory()
+        h.insert("0123")
+        h.action(InsertAction(2, "ab", 1, 2))
+        h.action(DeleteAction(2, 2, 2, 3))
+        # The text deleted around "ab", deleted itself since, stays deleted.
+        h.action(DeleteAction(1, 2, 1, 2))
+        self.assertEqual("03", h.text)
+
+        self.assertEqual(5, h.version)
+        self.assertEqual("0123", h.text_at(3))
+
+        h.action(InsertAction(1, "xyz", 5, 6))
+        h.action(ReplaceAction(2, "Y", 6, 7))
+        h.action(ReplaceAction(0, "AB", 5, 6))
+        self.assertEqual("ABxYz", h.text)
+
+    def test_apply_many(self):
+        h = TextHistory(checkpoint_every=2)
+        h.insert("abc")
+        actions = [
+            InsertAction(pos=0, text="x", from_version=1, to_version=2),
+            DeleteAction(pos=1, length=1, from_version=2, to_version=5),
+            ReplaceAction(pos=None, text="!", from_version=5, to_version=6),
+        ]
+        self.assertEqual(6, h.apply_many(actions))
+        self.assertEqual("xbc!", h.text)
+        self.assertEqual(actions, h.get_actions(1))
+        self.assertEqual("xbc", h.text_at(5))
+
+        # An invalid action in the middle leaves the history as it was.
+        bad = [
+            InsertAction(pos=0, text="y", from_version=6, to_version=7),
+            DeleteAction(pos=10, length=1, from_version=7, to_version=8),
+        ]
+        for actions in (bad, bad[:1] * 2):
+            with self.assertRaises(ValueError):
+                h.apply_many(actions)
+            self.assertEqual(("xbc!", 6, 4), (h.text, h.version, len(h.actions)))
+
+    def test_batch(self):
+        h = TextHistory()
+        with h.batch() as batch:
+            self.assertEqual(1, batch.insert("hello"))
+            batch.insert(" world")
+            batch.replace("H", pos=0)
+            self.assertEqual("", h.text)
+        self.assertEqual(("Hello world", 3), (h.text, h.version))
+
+        with self.assertRaises(KeyError):
+            with h.batch() as batch:
+                batch.delete(0, 5)
+                raise KeyError
+        self.assertEqual(("Hello world", 3), (h.text, h.version))
+
+        with h.batch(squash=True) as batch:
+            for char in "!!!":
+                batch.insert(char)
+        self.assertEqual(("Hello world!!!", 6), (h.text, h.version))
+        self.assertEqual([InsertAction(11, "!!!", 3, 6)], h.get_actions(3))
+
+
+class ActionLogTestCase(TestCase):
+    def test_list(self):
+        actions = [
+            InsertAction(pos=None, text="abc", from_version=0, to_version=1),
+            DeleteAction(pos=0, length=1, from_version=1, to_version=5),
+            ReplaceAction(pos=1, text="", from_version=5, to_version=2**40),
+        ]
+        log = ActionLog(actions)
+        self.assertEqual(actions, log[:])
+        self.assertEqual(actions[1], log[-2])
+        with self.assertRaises(IndexError):
+            log[3]
+
+        log[1:2] = [DeleteAction(pos=1, length=1, from_version=1, to_version=3)] * 2
+        del log[0]
+        log.insert(0, actions[0])
+        self.assertEqual([1, 3, 3, 2**40], list(log.to_versions))
+        self.assertEqual(1, log[1].pos)
+
+    def test_removed(self):
+        log = ActionLog()
+        log.extend([InsertAction(0, "ab", 0, 1), DeleteAction(0, 1, 1, 2)], ["", "a"])
+        log.append(ReplaceAction(0, "ж", 2, 2**40), "b")
+        self.assertEqual(["", "a", "b"], log.removed[:])
+        log[0:1] = [InsertAction(0, "cd", 0, 1)]
+        self.assertEqual([None, "a", "b"], log.removed[:])
+        self.assertEqual("cd", log[0].new_text)
+        # Too far for a column, kept as is.
+        log.append(DeleteAction(2**32, 1, 2**40, 2**40 + 1), "e")
+        self.assertEqual(DeleteAction(2**32, 1, 2**40, 2**40 + 1), log[-1])
+        self.assertEqual("e", log.removed[-1])
+        self.assertEqual(ActionLog.OTHER, log.kinds[-1])
+
+    def test_compact_reclaims_text(self):
+        h = TextHistory(columnar=True)
+        for i in range(50):
+            h.insert("abc")
+            h.replace("xyz", pos=3 * i)
+            h.compact()
+            self.assertLessEqual(len(h.actions.text), 2 * 3 * (i + 1))
+        self.assertEqual([InsertAction(0, "xyz" * 50, 0, 100)], h.get_actions())
+        self.assertEqual([""], h._removed[:])
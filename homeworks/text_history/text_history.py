@@ -1,7 +1,16 @@
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import Iterable, Iterator, MutableSequence, Sequence
 from math import inf
+from operator import attrgetter
 from typing import List
 
+from rope import Rope
+from storage import ActionFile
+
 
 class Action(ABC):
     def __init__(self, pos: int, from_version: int, to_version: int) -> None:
@@ -37,6 +46,31 @@ class Action(ABC):
     def apply(self, old_text: str) -> str:
         pass
 
+    def edit(self, rope: Rope) -> Rope:
+        """Applies the action to a rope, which is not changed but copied."""
+        return Rope(self.apply(str(rope)))
+
+    def removed_text(self, rope: Rope) -> str | None:
+        """Returns the text of `rope` the action removes, None if unknown.
+
+        Actions that return it also define `revert(rope, removed)`, which
+        undoes the action on the rope it produced. Others are never
+        reverted, older versions are rebuilt forwards past them.
+        """
+        return None
+
+    def __eq__(self, other: object) -> bool:
+        if type(self) is not type(other):
+            return NotImplemented
+        return vars(self) == vars(other)
+
+    def __hash__(self) -> int:
+        return hash((type(self), *vars(self).values()))
+
+    def check_versions(self) -> None:
+        if self.from_version >= self.to_version or self.from_version < 0:
+            raise ValueError("Wrong version values")
+
 
 class InsertAction(Action):
     def __init__(self, pos: int, text: str, from_version: int, to_version: int) -> None:
@@ -62,6 +96,22 @@ class InsertAction(Action):
             else:
                 return f"{old_text[0: self.pos]}{self.new_text}{old_text[self.pos:]}"
 
+    def edit(self, rope: Rope) -> Rope:
+        self.check_versions()
+        if self.pos is None:
+            return rope.insert(len(rope), self.new_text)
+        if self.pos > len(rope) or self.pos < 0:
+            raise ValueError
+        return rope.insert(self.pos, self.new_text)
+
+    def removed_text(self, rope: Rope) -> str:
+        return ""
+
+    def revert(self, rope: Rope, removed: str) -> Rope:
+        # Without a position the text went to the end.
+        pos = len(rope) - len(self.new_text) if self.pos is None else self.pos
+        return rope.delete(pos, len(self.new_text))
+
 
 class ReplaceAction(Action):
     def __init__(self, pos: int, text: str, from_version: int, to_version: int) -> None:
@@ -87,6 +137,23 @@ class ReplaceAction(Action):
             else:
                 return f"{old_text[0: self.pos]}{self.new_text}{old_text[self.pos  + len(self.new_text):]}"
 
+    def edit(self, rope: Rope) -> Rope:
+        self.check_versions()
+        if self.pos is None:
+            return rope.insert(len(rope), self.new_text)
+        if self.pos > len(rope) or self.pos < 0:
+            raise ValueError
+        return rope.replace(self.pos, self.new_text)
+
+    def removed_text(self, rope: Rope) -> str:
+        if self.pos is None:
+            return ""
+        return rope.substring(self.pos, self.pos + len(self.new_text))
+
+    def revert(self, rope: Rope, removed: str) -> Rope:
+        pos = len(rope) - len(self.new_text) if self.pos is None else self.pos
+        return rope.delete(pos, len(self.new_text)).insert(pos, removed)
+
 
 class DeleteAction(Action):
     def __init__(
@@ -119,20 +186,576 @@ class DeleteAction(Action):
         else:
             return f"{old_text[0:self.pos]}{old_text[self.pos + self.length:]}"
 
+    def edit(self, rope: Rope) -> Rope:
+        self.check_versions()
+        if self.pos > len(rope) or self.pos < 0 or self.length > len(rope) - self.pos:
+            raise ValueError
+        return rope.delete(self.pos, self.length)
+
+    def removed_text(self, rope: Rope) -> str:
+        return rope.substring(self.pos, self.pos + self.length)
+
+    def revert(self, rope: Rope, removed: str) -> Rope:
+        return rope.insert(self.pos, removed)
+
+
+def splice(action: Action, length: int) -> tuple[int, int, str] | None:
+    """Returns the action as (pos, deleted length, inserted text).
+
+    `length` is the length of the text the action applies to. None if the
+    action is not one of the known kinds.
+    """
+    if isinstance(action, DeleteAction):
+        return action.pos, action.length, ""
+    if isinstance(action, ReplaceAction):
+        if action.pos is None:
+            return length, 0, action.new_text
+        text = action.new_text
+        return action.pos, min(len(text), length - action.pos), text
+    if isinstance(action, InsertAction):
+        pos = length if action.pos is None else action.pos
+        return pos, 0, action.new_text
+    return None
+
+
+def splice_actions(
+    pos: int, deleted: int, text: str, length: int, versions: tuple[int, int, int]
+) -> list[Action]:
+    """Returns the fewest actions that make a splice of a text of `length`.
+
+    `versions` are the first, an intermediate and the last version, the
+    intermediate one is used if the splice takes two actions.
+    """
+    first, middle, last = versions
+    if not deleted:
+        return [InsertAction(pos, text, first, last)] if text else []
+    if not text:
+        return [DeleteAction(pos, deleted, first, last)]
+    if len(text) == deleted or (len(text) > deleted and pos + deleted == length):
+        return [ReplaceAction(pos, text, first, last)]
+    if len(text) > deleted:
+        return [
+            ReplaceAction(pos, text[:deleted], first, middle),
+            InsertAction(pos + deleted, text[deleted:], middle, last),
+        ]
+    return [
+        ReplaceAction(pos, text, first, middle),
+        DeleteAction(pos + len(text), deleted - len(text), middle, last),
+    ]
+
+
+def transform(
+    mine: tuple[int, int, str], theirs: tuple[int, int, str]
+) -> list[tuple[int, int, str]]:
+    """Returns splice `mine` moved past the concurrent splice `theirs`.
+
+    Both are made on the same text, the result applies to the text
+    `theirs` made. Text that `theirs` deleted is not deleted again and
+    the text it inserted is kept; of two inserts at one place the one
+    already made goes first. If the two overlap, `mine` becomes up to two
+    splices of the same text, on both sides of the inserted text.
+    """
+    pos, deleted, text = mine
+    at, cut, new_text = theirs
+    if pos + deleted < at or (pos + deleted == at and (deleted or cut)):
+        return [mine]
+    if pos >= at + cut:
+        return [(pos - cut + len(new_text), deleted, text)]
+    # The inserted text is left out of `mine`: the actions after `theirs`
+    # may have changed it, copying it would undo them.
+    splices = []
+    if pos < at:
+        splices.append((pos, at - pos, text))
+        text = ""
+    tail = pos + deleted - (at + cut)
+    if tail > 0 or text:
+        splices.append((at + len(new_text), max(tail, 0), text))
+    return splices
+
+
+class ActionsView(Sequence):
+    """Read-only view of a slice of an action list, nothing is copied.
+
+    The view keeps the indices it was made with, so it sees the actions
+    appended later only if they fall inside them.
+    """
+
+    __slots__ = ("_actions", "_start", "_stop")
+
+    def __init__(self, actions: list[Action], start: int, stop: int) -> None:
+        self._actions = actions
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return ActionsView(
+                    self._actions, self._start + start, self._start + max(start, stop)
+                )
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ActionsView index out of range")
+        return self._actions[self._start + index]
+
+    def __iter__(self) -> Iterator[Action]:
+        # islice would step through everything before the start.
+        return map(self._actions.__getitem__, range(self._start, self._stop))
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (ActionsView, list, tuple)):
+            return len(self) == len(other) and all(
+                a is b or a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ActionsView({list(self)!r})"
+
+
+class ActionLog(MutableSequence):
+    """List of actions kept in columns instead of objects.
+
+    Kinds, positions, lengths and versions are typed arrays and the text
+    inserts and replaces carry, followed by the text the action removed, is
+    UTF-8 in one buffer, an Action is only built when read. A stored action
+    takes some 30 bytes plus its text, an object and its removed string
+    some 180. Actions of unknown kinds, with positions, lengths or version
+    steps that do not fit in an unsigned int, or whose text would start
+    past the first 4 GiB of the buffer, are kept as they are.
+    """
+
+    INSERT, REPLACE, DELETE, OTHER = range(4)
+    # Of kinds, positions, lengths, starts, removed lengths and the two
+    # versions.
+    TYPECODES = "BIIIIIq"
+    # Bound of lengths and version steps.
+    LIMIT = 2 ** (8 * array("I").itemsize)
+    # A position of None, in files. Columns hold positions plus one, so
+    # it is 0 there.
+    END = -1
+    # Removed length of an action whose removed text is not known.
+    UNKNOWN = LIMIT - 1
+
+    def __init__(self, actions: Iterable[Action] = ()) -> None:
+        self.kinds = array("B")
+        self.positions = array("I")
+        # Length of a delete, or of the text in the buffer.
+        self.lengths = array("I")
+        # Where the text starts in the buffer, or the index in `others`.
+        self.starts = array("I")
+        # Length of the removed text, right after the text in the buffer.
+        self.removed_lengths = array("I")
+        # to_version - from_version.
+        self.steps = array("I")
+        self.to_versions = array("q")
+        self.text = bytearray()
+        # (action, removed text) of the actions kept as they are.
+        self.others = []
+        # Bytes of the buffer, and entries of `others`, no row refers to.
+        self.garbage = 0
+        self.removed = MappedColumn(self, self._read_removed)
+        self.extend(actions)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        kind = self.kinds[index]
+        start = self.starts[index]
+        if kind == self.OTHER:
+            return self.others[start][0]
+        pos = self.positions[index] - 1
+        pos = None if pos == self.END else pos
+        length = self.lengths[index]
+        to_version = self.to_versions[index]
+        versions = to_version - self.steps[index], to_version
+        if kind == self.DELETE:
+            return DeleteAction(pos, length, *versions)
+        text = self.text[start : start + length].decode()
+        if kind == self.INSERT:
+            return InsertAction(pos, text, *versions)
+        return ReplaceAction(pos, text, *versions)
+
+    def _read_removed(self, index: int) -> str | None:
+        start = self.starts[index]
+        if self.kinds[index] == self.OTHER:
+            return self.others[start][1]
+        length = self.removed_lengths[index]
+        if length == self.UNKNOWN:
+            return None
+        if self.kinds[index] != self.DELETE:
+            start += self.lengths[index]
+        return self.text[start : start + length].decode()
+
+    def _size(self, index: int) -> int:
+        """Returns the bytes of the buffer taken by an action."""
+        if self.kinds[index] == self.OTHER:
+            return 1
+        size = 0 if self.kinds[index] == self.DELETE else self.lengths[index]
+        if self.removed_lengths[index] != self.UNKNOWN:
+            size += self.removed_lengths[index]
+        return size
+
+    def _encode(
+        self, actions: Iterable[Action], removed: Iterable[str | None]
+    ) -> list[array]:
+        """Returns the columns of `actions`, their text goes to the buffer."""
+        columns = [array(typecode) for typecode in self.TYPECODES]
+        for action, removed_text in zip(actions, removed):
+            step = action.to_version - action.from_version
+            text = b""
+            if isinstance(action, DeleteAction):
+                kind, length = self.DELETE, action.length
+            elif isinstance(action, (InsertAction, ReplaceAction)):
+                kind = self.INSERT
+                if isinstance(action, ReplaceAction):
+                    kind = self.REPLACE
+                text = action.new_text.encode()
+                length = len(text)
+            else:
+                kind, length = self.OTHER, 0
+            pos = 0
+            if kind != self.OTHER:
+                pos = (self.END if action.pos is None else action.pos) + 1
+            removed_bytes = b""
+            removed_length = self.UNKNOWN
+            if removed_text is not None:
+                removed_bytes = removed_text.encode()
+                removed_length = len(removed_bytes)
+            if kind == self.OTHER or not (
+                0 <= pos < self.LIMIT
+                and 0 <= length < self.LIMIT
+                and len(self.text) < self.LIMIT
+                and 0 <= step < self.LIMIT
+                and removed_length < self.UNKNOWN
+            ):
+                row = self.OTHER, 0, 0, len(self.others), 0, 0, action.to_version
+                self.others.append((action, removed_text))
+            else:
+                start = len(self.text)
+                row = kind, pos, length, start, removed_length, step, action.to_version
+                self.text += text
+                self.text += removed_bytes
+            for column, value in zip(columns, row):
+                column.append(value)
+        return columns
+
+    def _columns(self) -> list[array]:
+        return [
+            self.kinds,
+            self.positions,
+            self.lengths,
+            self.starts,
+            self.removed_lengths,
+            self.steps,
+            self.to_versions,
+        ]
+
+    def __setitem__(self, index, actions) -> None:
+        if not isinstance(index, slice):
+            self.kinds[index]  # IndexError if out of range
+            index, actions = slice(index, index + 1 or None), [actions]
+        if index.step not in (None, 1):
+            raise ValueError("ActionLog slices can not have a step")
+        actions = list(actions)
+        self._replace(index, actions, [None] * len(actions))
+
+    def __delitem__(self, index) -> None:
+        if not isinstance(index, slice):
+            self.kinds[index]  # IndexError if out of range
+            index = slice(index, index + 1 or None)
+        self[index] = []
+
+    def insert(self, index: int, action: Action) -> None:
+        self[index:index] = [action]
+
+    def append(self, action: Action, removed: str | None = None) -> None:
+        for column, values in zip(self._columns(), self._encode([action], [removed])):
+            column.extend(values)
+
+    def extend(
+        self, actions: Iterable[Action], removed: Iterable[str | None] | None = None
+    ) -> None:
+        """Appends `actions`, with the text each removed if it is known."""
+        actions = list(actions)
+        if removed is None:
+            removed = [None] * len(actions)
+        for column, values in zip(self._columns(), self._encode(actions, removed)):
+            column.extend(values)
+
+    def replace(
+        self, start: int, stop: int, actions: list[Action], removed: list[str | None]
+    ) -> None:
+        """Replaces the actions from `start` to `stop`."""
+        self._replace(slice(start, stop), actions, removed)
+
+    def _replace(
+        self, index: slice, actions: list[Action], removed: list[str | None]
+    ) -> None:
+        self.garbage += sum(map(self._size, range(*index.indices(len(self)))))
+        for column, values in zip(self._columns(), self._encode(actions, removed)):
+            column[index] = values
+        # Rewritten once half of it is unused, so replacing stays amortized O(1)
+        # per byte written.
+        if self.garbage * 2 > len(self.text) + len(self.others):
+            self._pack()
+
+    def _pack(self) -> None:
+        """Drops the text and the actions no row refers to any more."""
+        text, others = bytearray(), []
+        for index, kind in enumerate(self.kinds):
+            start = self.starts[index]
+            if kind == self.OTHER:
+                self.starts[index] = len(others)
+                others.append(self.others[start])
+            else:
+                self.starts[index] = len(text)
+                text += self.text[start : start + self._size(index)]
+        self.text, self.others = text, others
+        self.garbage = 0
+
+
+class MappedColumn(Sequence):
+    """Read-only sequence of one field of an ActionFile or an ActionLog."""
+
+    def __init__(self, file: "ActionFile | ActionLog", read) -> None:
+        self._file = file
+        self._read = read
+
+    def __len__(self) -> int:
+        return len(self._file)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._read(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("MappedColumn index out of range")
+        return self._read(index)
+
+
+class FileActionLog(MappedColumn):
+    """Actions stored in an ActionFile along with the text they removed.
+
+    Actions are read back from the mapped file as they are accessed, only
+    inserts, replaces and deletes can be stored.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = ActionFile(path)
+        super().__init__(self.file, self._read_action)
+        self.to_versions = MappedColumn(self.file, self.file.to_version)
+        self.removed = MappedColumn(self.file, self._read_removed)
+
+    def _read_action(self, index: int) -> Action:
+        kind, pos, from_version, to_version, length, text, _ = self.file.record(index)
+        pos = None if pos == ActionLog.END else pos
+        if kind == ActionLog.DELETE:
+            return DeleteAction(pos, length, from_version, to_version)
+        if kind == ActionLog.INSERT:
+            return InsertAction(pos, text.decode(), from_version, to_version)
+        return ReplaceAction(pos, text.decode(), from_version, to_version)
+
+    def _read_removed(self, index: int) -> str | None:
+        removed = self.file.record(index)[-1]
+        return None if removed is None else removed.decode()
+
+    def append(self, action: Action, removed: str | None) -> None:
+        self.file.append(*self._encode(action, removed))
+
+    def extend(self, actions: list[Action], removed: list[str | None]) -> None:
+        # Encoded first, so an action that can not be stored stores none.
+        for record in [self._encode(*pair) for pair in zip(actions, removed)]:
+            self.file.append(*record)
+
+    @staticmethod
+    def _encode(action: Action, removed: str | None) -> tuple:
+        if isinstance(action, DeleteAction):
+            kind, length, text = ActionLog.DELETE, action.length, b""
+        elif isinstance(action, (InsertAction, ReplaceAction)):
+            kind = ActionLog.INSERT
+            if isinstance(action, ReplaceAction):
+                kind = ActionLog.REPLACE
+            length, text = 0, action.new_text.encode()
+        else:
+            raise TypeError("Only inserts, replaces and deletes can be stored")
+        return (
+            kind,
+            ActionLog.END if action.pos is None else action.pos,
+            action.from_version,
+            action.to_version,
+            length,
+            text,
+            None if removed is None else removed.encode(),
+        )
+
+    def replace(
+        self, start: int, stop: int, actions: list[Action], removed: list[str | None]
+    ) -> None:
+        """Replaces the actions from `start` to `stop`, rewriting the rest."""
+        rest = list(zip(self[stop:], self.removed[stop:]))
+        self.file.truncate(start)
+        for action, text in [*zip(actions, removed), *rest]:
+            self.append(action, text)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Batch:
+    """Edits of a TextHistory.batch block, numbered on from its version."""
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+        self.actions = []
+
+    def _add(self, action: Action) -> int:
+        self.actions.append(action)
+        self.version = action.to_version
+        return self.version
+
+    def insert(self, text: str, pos: int = None) -> int:
+        return self._add(InsertAction(pos, text, self.version, self.version + 1))
+
+    def replace(self, text: str, pos: int = None) -> int:
+        return self._add(ReplaceAction(pos, text, self.version, self.version + 1))
+
+    def delete(self, pos: int, length: int) -> int:
+        return self._add(DeleteAction(pos, length, self.version, self.version + 1))
+
 
 class TextHistory:
-    def __init__(self):
-        self.text = ""
+    """Text with the history of its changes.
+
+    Old versions are rebuilt by `text_at` from checkpoints kept every
+    `checkpoint_every` actions: forwards by applying actions, or backwards
+    by reverting them with the text they removed, whichever is shorter.
+    The last `cache_size` versions rebuilt are cached.
+
+    With a `path` the actions are stored in files there, see `storage`, and
+    a snapshot of the text is written every `snapshot_every` actions and on
+    `close`. Opening the history again loads the snapshot and replays only
+    the actions after it.
+    """
+
+    def __init__(
+        self,
+        checkpoint_every: int = 100,
+        cache_size: int = 32,
+        columnar: bool = False,
+        path: str | None = None,
+        snapshot_every: int = 10000,
+    ):
+        # The text is edited as a rope, the string is only built when read.
+        self._rope = Rope()
+        self._text = ""
         self.version = 0
-        self.actions = list()
+        # A columnar log takes several times less memory, but builds the
+        # actions anew every time they are read.
+        self.actions = ActionLog() if columnar else list()
+        self._checkpoint_every = checkpoint_every
+        # Ropes share their nodes, so a checkpoint only costs the nodes
+        # changed since the one before. A checkpoint is kept after
+        # _checkpoint_counts[i] actions, one every K actions.
+        self._checkpoints = [self._rope]
+        self._checkpoint_counts = [0]
+        # Text removed by every action, to revert it.
+        self._removed = list()
+        if columnar:
+            self._removed = self.actions.removed
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._snapshot_every = snapshot_every
+        self._snapshot_count = 0
+        if path is not None:
+            self.actions = FileActionLog(path)
+            self._removed = self.actions.removed
+            self._load()
+
+    def _load(self) -> None:
+        count, version, text = self.actions.file.read_snapshot()
+        self._snapshot_count = count
+        rope = Rope(text)
+        if count:
+            # Older versions are reverted from the snapshot.
+            self._checkpoints.append(rope)
+            self._checkpoint_counts.append(count)
+        for index in range(count, len(self.actions)):
+            rope = self.actions[index].edit(rope)
+            if index + 1 - self._checkpoint_counts[-1] >= self._checkpoint_every:
+                self._checkpoints.append(rope)
+                self._checkpoint_counts.append(index + 1)
+        self._rope = rope
+        self._text = None
+        if len(self.actions) > count:
+            version = self.actions.to_versions[-1]
+        self.version = version
+
+    def close(self) -> None:
+        """Writes a snapshot and closes the files of a stored history."""
+        if isinstance(self.actions, FileActionLog):
+            self._snapshot()
+            self.actions.close()
+
+    def __enter__(self) -> "TextHistory":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _snapshot(self) -> None:
+        if self._snapshot_count != len(self.actions):
+            self.actions.file.write_snapshot(len(self.actions), self.version, self.text)
+            self._snapshot_count = len(self.actions)
 
     @property
     def text(self) -> str:
+        if self._text is None:
+            self._text = str(self._rope)
         return self._text
 
-    @text.setter
-    def text(self, value) -> None:
-        self._text = value
+    def _commit(self, action: Action) -> int:
+        return self._commit_many([action])
+
+    def _commit_many(self, actions: list[Action]) -> int:
+        # Nothing is changed until all of them have applied.
+        rope = self._rope
+        removed = []
+        checkpoints = []
+        count, last = len(self.actions), self._checkpoint_counts[-1]
+        for action in actions:
+            edited = action.edit(rope)
+            removed.append(action.removed_text(rope))
+            rope = edited
+            count += 1
+            if count - last >= self._checkpoint_every:
+                checkpoints.append((count, rope))
+                last = count
+        if isinstance(self.actions, list):
+            self.actions.extend(actions)
+            self._removed.extend(removed)
+        else:
+            self.actions.extend(actions, removed)
+        for count, checkpoint in checkpoints:
+            self._checkpoint_counts.append(count)
+            self._checkpoints.append(checkpoint)
+        self._rope = rope
+        self._text = None
+        self.version = actions[-1].to_version
+        if len(self.actions) - self._snapshot_count >= self._snapshot_every:
+            if isinstance(self.actions, FileActionLog):
+                self._snapshot()
+        return self.version
 
     @property
     def version(self) -> int:
@@ -157,10 +780,7 @@ class TextHistory:
             from_version=self.version,
             to_version=self.version + 1,
         )
-        self.text = insert_action.apply(self.text)
-        self.version = insert_action.to_version
-        self.actions.append(insert_action)
-        return insert_action.to_version
+        return self._commit(insert_action)
 
     def replace(self, text: str, pos: int = None) -> int:
         replace_action = ReplaceAction(
@@ -169,10 +789,7 @@ class TextHistory:
             from_version=self.version,
             to_version=self.version + 1,
         )
-        self.text = replace_action.apply(self.text)
-        self.version = replace_action.to_version
-        self.actions.append(replace_action)
-        return replace_action.to_version
+        return self._commit(replace_action)
 
     def delete(self, pos: int, length: int) -> int:
         delete_action = DeleteAction(
@@ -181,28 +798,248 @@ class TextHistory:
             from_version=self.version,
             to_version=self.version + 1,
         )
-        self.text = delete_action.apply(self.text)
-        self.version = delete_action.to_version
-        self.actions.append(delete_action)
-        return delete_action.to_version
+        return self._commit(delete_action)
 
     def action(self, action: Action) -> int:
-        self.text = action.apply(self.text)
-        self.version = action.to_version
-        self.actions.append(action)
-        return action.to_version
+        """Applies `action`, returns the new version.
+
+        An action made on an older version than the current one is moved
+        past the actions made since with `transform`, so concurrent writers
+        do not have to retry. It then gets the version after the current
+        one, if its own is already taken.
+        """
+        if action.from_version >= self.version:
+            return self._commit(action)
+        action.check_versions()
+        start = self._count_until(action.from_version)
+        since = self.actions[start:]
+        # Lengths of the text before each of them, from the current one back.
+        lengths = [len(self._rope)]
+        for other, removed in zip(reversed(since), reversed(self._removed[start:])):
+            if removed is None:
+                raise ValueError("Can not rebase over an action of unknown kind")
+            inserted = 0
+            if isinstance(other, (InsertAction, ReplaceAction)):
+                inserted = len(other.new_text)
+            lengths.append(lengths[-1] - inserted + len(removed))
+        lengths.reverse()
+
+        mine = splice(action, lengths[0])
+        if mine is None:
+            raise ValueError("Can not rebase an action of unknown kind")
+        pos, deleted, _ = mine
+        if pos < 0 or deleted < 0 or pos + deleted > lengths[0]:
+            raise ValueError
+        # Splices of one text, in order, that `action` becomes.
+        mine = [mine]
+        for other, length in zip(since, lengths):
+            theirs = splice(other, length)
+            mine = [part for own in mine for part in transform(own, theirs)]
+
+        rebased = []
+        length = len(self._rope)
+        # From the last one back, the positions of the ones before stay valid.
+        for pos, deleted, text in reversed(mine):
+            rebased += splice_actions(pos, deleted, text, length, (0, 0, 0))
+            length += len(text) - deleted
+        for number, rebased_action in enumerate(rebased):
+            rebased_action.from_version = self.version + number
+            rebased_action.to_version = self.version + number + 1
+        if rebased:
+            # Numbered on from the current version, the last one keeps the
+            # version it was made for if that is still free.
+            last = rebased[-1]
+            last.to_version = max(action.to_version, self.version + len(rebased))
+        for rebased_action in rebased:
+            self._commit(rebased_action)
+        return self.version
+
+    def apply_many(self, actions: Iterable[Action]) -> int:
+        """Applies `actions` one after another, returns the new version.
+
+        They are checked and applied together: if one is invalid, none is.
+        Each has to start at or after the version the one before made.
+        """
+        actions = list(actions)
+        version = self.version
+        for action in actions:
+            if action.from_version < version:
+                raise ValueError("Actions overlap")
+            version = action.to_version
+        if not actions:
+            return self.version
+        return self._commit_many(actions)
 
-    def get_actions(self, from_version: int = 0, to_version: int = inf) -> list[Action]:
-        if from_version > to_version:
+    @contextmanager
+    def batch(self, squash: bool = False) -> Iterator["Batch"]:
+        """Collects edits and applies them with `apply_many` at the end.
+
+        Nothing is applied if the block raises. With `squash` the edits
+        are compacted afterwards.
+        """
+        batch = Batch(self.version)
+        yield batch
+        start = self.version
+        self.apply_many(batch.actions)
+        if squash:
+            self.compact(start, self.version)
+
+    def text_at(self, version: int) -> str:
+        """Returns the text as it was at `version`."""
+        if version < 0 or version > self.version:
             raise ValueError("Incorrect Versions")
-        elif from_version < to_version:
-            return [
-                i
-                for i in self.actions
-                if ((i.to_version >= from_version) and (i.to_version <= to_version))
-            ]
-        elif to_version == 0:
-            return list()
-
-        elif from_version == to_version:
-            return [i for i in self.actions if i.to_version == from_version]
+        count = self._count_until(version)
+        if count == len(self.actions):
+            return self.text
+        text = self._cache.get(count)
+        if text is None:
+            text = str(self._rope_after(count))
+            self._cache[count] = text
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(count)
+        return text
+
+    def _rope_after(self, count: int) -> Rope:
+        """Returns the rope after the first `count` actions."""
+        index = bisect_right(self._checkpoint_counts, count) - 1
+        start = self._checkpoint_counts[index]
+        if index + 1 < len(self._checkpoints):
+            stop = self._checkpoint_counts[index + 1]
+            rope = self._checkpoints[index + 1]
+        else:
+            stop = len(self.actions)
+            rope = self._rope
+        removed = self._removed[count:stop]
+        # Checkpoints missing on the way, like those before the snapshot of
+        # a reopened history, are kept as they are passed.
+        every = self._checkpoint_every
+        if stop - count < count - start and None not in removed:
+            # The next checkpoint, or the current text, is nearer.
+            actions = self.actions[count:stop]
+            for action, text in zip(reversed(actions), reversed(removed)):
+                rope = action.revert(rope, text)
+                stop -= 1
+                if stop >= count and (stop - start) % every == 0:
+                    self._keep_checkpoint(index + 1, stop, rope)
+            return rope
+        rope = self._checkpoints[index]
+        for passed, action in enumerate(self.actions[start:count], 1):
+            rope = action.edit(rope)
+            if passed % every == 0:
+                index += 1
+                self._keep_checkpoint(index, start + passed, rope)
+        return rope
+
+    def _keep_checkpoint(self, index: int, count: int, rope: Rope) -> None:
+        self._checkpoint_counts.insert(index, count)
+        self._checkpoints.insert(index, rope)
+
+    def compact(self, from_version: int = 0, to_version: int = inf) -> int:
+        """Merges the actions between two versions, returns how many are gone.
+
+        Runs of actions that touch the same stretch of text, like typing,
+        an insert deleted again or a replace of fresh text, become a single
+        splice of the text, written back as at most two actions, or as an
+        empty insert if the run undoes itself. The text of the versions
+        inside a merged run is lost, `text_at` returns the text before the
+        run for them. Views from `get_actions` are stale afterwards.
+        """
+        actions = self.get_actions(from_version, to_version)
+        start, stop = actions._start, actions._stop
+        if len(actions) < 2:
+            return 0
+        rope = self._rope_after(start)
+        compacted, removed = [], []
+        # The run being merged: its actions, the text before it and its splice.
+        run, before, merged = [], rope, None
+
+        def close_run():
+            nonlocal before
+            new = None
+            if len(run) > 1:
+                versions = run[0].from_version, run[-2].to_version, run[-1].to_version
+                # A run that undoes itself still carries its versions.
+                new = splice_actions(*merged, len(before), versions) or [
+                    InsertAction(merged[0], "", versions[0], versions[2])
+                ]
+            if new is None or len(new) >= len(run):
+                new = run
+            for action in new:
+                removed.append(action.removed_text(before))
+                before = action.edit(before)
+            compacted.extend(new)
+
+        for action in actions:
+            step = splice(action, len(rope))
+            if merged is not None and step is not None:
+                pos, deleted, text = merged
+                at, cut, new_text = step
+                if at <= pos + len(text) and at + cut >= pos:
+                    # Both change the same stretch, `rope` is the text between.
+                    begin = min(pos, at)
+                    end = max(pos + len(text), at + cut)
+                    merged = (
+                        begin,
+                        end - len(text) + deleted - begin,
+                        rope.substring(begin, at)
+                        + new_text
+                        + rope.substring(at + cut, end),
+                    )
+                    run.append(action)
+                    rope = action.edit(rope)
+                    continue
+            if run:
+                close_run()
+            run, merged = [action], step
+            rope = action.edit(rope)
+        close_run()
+
+        if isinstance(self.actions, FileActionLog):
+            if self._snapshot_count > start:
+                # The snapshot must stay valid if the rewrite is cut short.
+                version = self.actions.to_versions[start - 1] if start else 0
+                self.actions.file.write_snapshot(
+                    start, version, str(self._rope_after(start))
+                )
+                self._snapshot_count = start
+        if isinstance(self.actions, list):
+            self.actions[start:stop] = compacted
+            self._removed[start:stop] = removed
+        else:
+            self.actions.replace(start, stop, compacted, removed)
+        gone = (stop - start) - len(compacted)
+        # Checkpoints inside the range are dropped, the later ones move down.
+        kept = [
+            (count if count <= start else count - gone, checkpoint)
+            for count, checkpoint in zip(self._checkpoint_counts, self._checkpoints)
+            if count <= start or count >= stop
+        ]
+        self._checkpoint_counts = [count for count, _ in kept]
+        self._checkpoints = [checkpoint for _, checkpoint in kept]
+        self._cache.clear()
+        return gone
+
+    def get_actions(
+        self, from_version: int = 0, to_version: int = inf
+    ) -> "ActionsView":
+        """Returns the actions that led from `from_version` to `to_version`.
+
+        Versions only grow, so the range is found by bisection and returned
+        as a view of the log rather than a copy.
+        """
+        if from_version < 0 or from_version > to_version:
+            raise ValueError("Incorrect Versions")
+        if to_version != inf and to_version > self.version:
+            raise ValueError("Incorrect Versions")
+        start = self._count_until(from_version)
+        stop = self._count_until(to_version, start)
+        return ActionsView(self.actions, start, stop)
+
+    def _count_until(self, version: int, lo: int = 0) -> int:
+        """Returns the number of actions up to `version`."""
+        to_versions = getattr(self.actions, "to_versions", None)
+        if to_versions is not None:
+            return bisect_right(to_versions, version, lo)
+        return bisect_right(self.actions, version, lo, key=attrgetter("to_version"))